@@ -2,6 +2,8 @@
 import logging
 import subprocess
 
+from models import Track
+
 
 # The AppleScript API uses macOS's AppleScript to send commandline instructions to Spotify, which natively
 # supports AppleScript.
@@ -45,15 +47,10 @@ class AppleScriptApi:
 
     @staticmethod
     def get_current_track():
-        track = dict()
-
-        # This specific format for the track is followed by the other local APIs.
-
-        track['name'] = AppleScriptApi.get_track()
-        track['artists'] = [{'name': AppleScriptApi.get_artist()}]
-        track['album'] = {'name': AppleScriptApi.get_album(), 'images': [{'url': AppleScriptApi.get_art_url()}]}
-
-        return track
+        # Local APIs return the same Track model as the Web API - the id is left out as it
+        # would cost another osascript call, and get_track_id() is there when it is needed.
+        return Track(None, AppleScriptApi.get_track(), [AppleScriptApi.get_artist()],
+                     AppleScriptApi.get_album(), [AppleScriptApi.get_art_url()])
 
     @staticmethod
     def play_pause():
@@ -0,0 +1,172 @@
+# How an account logs in and refreshes its tokens, chosen with 'backend' in config.ini:
+#   'relay' goes through the Spotify Helper server, which holds the app's client secret.
+#   'pkce' talks to accounts.spotify.com directly, using the Authorization Code with PKCE flow,
+#   which needs no secret, and catches the login redirect with a listener on this machine.
+# Both get their urls from the WebApi, so they can be pointed at a stand-in server.
+import base64
+import hashlib
+import logging
+import secrets
+import sys
+import time
+import webbrowser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from models import decode
+from notif_handler import send_notif
+
+# How long the user has to log in, in seconds.
+login_timeout = 120
+
+
+def exit_unauthenticated():
+    send_notif('Could not authenticate', 'Spotify Helper closed.')
+    sys.exit('Could not authenticate')
+
+
+class RelayAuth:
+    name = 'relay'
+
+    def __init__(self, web_api):
+        self.web_api = web_api
+        self.redirect_uri = 'https://platelminto.eu.pythonanywhere.com/users/registering'
+
+    # Blocks until the user has logged in, returning the token response's body.
+    def authorize(self):
+        self.generate_auth_code()
+
+        return self.get_access_info()
+
+    # This is how the user can authenticate themselves and must follow the instructions
+    # in the README.
+    def generate_auth_code(self):
+        params = {'client_id': self.web_api.client_id, 'response_type': 'code', 'state': self.web_api.uuid,
+                  'redirect_uri': self.redirect_uri,
+                  'scope': ' '.join(self.web_api.scope_list)}
+
+        r = requests.get(self.web_api.authorize_access_url, params=params)
+        webbrowser.open_new(r.url)
+
+    def get_access_info(self):
+        timeout = time.time()
+
+        while time.time() < timeout + login_timeout:  # We spend 2 minutes waiting for auth confirmation
+            response = requests.post(self.web_api.register_user_url,
+                                     json={'uuid': str(self.web_api.uuid)})
+            if response.status_code == 200:
+                logging.info('initial authentication done.')
+                send_notif('Success', 'You are now authenticated.')
+                return decode(response)
+
+            time.sleep(3)
+
+        exit_unauthenticated()
+
+    # Refreshing again gives another valid token, so it is safe to retry.
+    def refresh(self, refresh_token):
+        payload = {'grant_type': 'refresh_token', 'refresh_token': refresh_token,
+                   'uuid': str(self.web_api.uuid)}
+
+        return self.web_api.send('post', self.web_api.refresh_token_url, True, json=payload, timeout=4)
+
+
+class LoopbackRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        # Browsers also ask for things like /favicon.ico.
+        if url.path != '/callback':
+            self.send_error(404)
+            return
+
+        self.server.query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        body = b'<html><body>Spotify Helper: you can close this window.</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class PkceAuth:
+    name = 'pkce'
+
+    # port has to match a redirect URI allowed in the app's settings on Spotify's dashboard.
+    def __init__(self, web_api, port=8888):
+        self.web_api = web_api
+        self.port = port
+        self.redirect_uri = 'http://127.0.0.1:{}/callback'.format(port)
+
+    @staticmethod
+    def get_code_challenge(code_verifier):
+        digest = hashlib.sha256(code_verifier.encode()).digest()
+
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def authorize(self):
+        code_verifier = secrets.token_urlsafe(64)  # 86 characters, Spotify allows 43 to 128
+        state = secrets.token_urlsafe(16)
+
+        params = {'client_id': self.web_api.client_id, 'response_type': 'code', 'state': state,
+                  'redirect_uri': self.redirect_uri, 'scope': ' '.join(self.web_api.scope_list),
+                  'code_challenge_method': 'S256', 'code_challenge': PkceAuth.get_code_challenge(code_verifier)}
+
+        # Listening before the browser opens, so the redirect can't arrive before we do.
+        with HTTPServer(('127.0.0.1', self.port), LoopbackRequestHandler) as server:
+            server.query = None
+            webbrowser.open_new(requests.Request('GET', self.web_api.authorize_access_url, params=params)
+                                .prepare().url)
+
+            query = PkceAuth.wait_for_redirect(server)
+
+        if query is None or query.get('state') != state or 'code' not in query:
+            logging.warning('Authorization failed: {}'.format(query))
+            exit_unauthenticated()
+
+        payload = {'grant_type': 'authorization_code', 'code': query['code'], 'redirect_uri': self.redirect_uri,
+                   'client_id': self.web_api.client_id, 'code_verifier': code_verifier}
+
+        # Codes can only be used once, so this isn't retried after it may have reached Spotify.
+        response = self.web_api.send('post', self.web_api.token_url, False, data=payload, timeout=4)
+
+        if response.status_code != 200:
+            logging.warning('Could not exchange the authorization code: {}'.format(response.content))
+            exit_unauthenticated()
+
+        logging.info('initial authentication done.')
+        send_notif('Success', 'You are now authenticated.')
+        return decode(response)
+
+    # Returns the redirect's query, or None if it didn't come in time.
+    @staticmethod
+    def wait_for_redirect(server):
+        timeout = time.time() + login_timeout
+
+        while server.query is None and time.time() < timeout:
+            server.timeout = max(0.1, timeout - time.time())
+            server.handle_request()
+
+        return server.query
+
+    def refresh(self, refresh_token):
+        payload = {'grant_type': 'refresh_token', 'refresh_token': refresh_token,
+                   'client_id': self.web_api.client_id}
+
+        return self.web_api.send('post', self.web_api.token_url, True, data=payload, timeout=4)
+
+
+def get_auth_backend(web_api, config):
+    backend = config.get('authentication', 'backend', fallback='relay')
+
+    if backend == 'pkce':
+        return PkceAuth(web_api, config.getint('authentication', 'loopback_port', fallback=8888))
+
+    return RelayAuth(web_api)
@@ -0,0 +1,87 @@
+# Chooses, for each method, whether the local API (e.g. AppleScript) or the Web API should run it,
+# from how long each has taken and how often it has failed for that method. Neither is always the
+# fastest: AppleScript starts a new process per call, so something needing several calls can be
+# slower than one request on a pooled connection, while the Web API can be slow or down.
+#
+# Every backend is tried at least min_samples times, and after that a random one is sometimes
+# tried first anyway, so the choice keeps up with backends getting faster or working again.
+import logging
+import random
+import threading
+
+
+class BackendStats:
+    __slots__ = ('latency', 'failure_rate', 'samples')
+
+    def __init__(self):
+        self.latency = None  # Only of successful calls
+        self.failure_rate = 0.0
+        self.samples = 0
+
+
+class BackendRouter:
+
+    # smoothing is how much each call counts towards the averages (the rest being earlier calls).
+    def __init__(self, smoothing=0.2, exploration=0.05, max_failure_rate=0.5, min_samples=3):
+        self.smoothing = smoothing
+        self.exploration = exploration
+        self.max_failure_rate = max_failure_rate
+        self.min_samples = min_samples
+
+        self.stats = {}  # (method, backend) -> BackendStats
+        self.lock = threading.Lock()
+
+    # Backends that have never worked aren't healthy, however few times they've been tried.
+    def is_healthy(self, stats):
+        return stats.latency is not None and stats.failure_rate <= self.max_failure_rate
+
+    # Healthy backends by latency, then the others by how often they fail.
+    def get_sort_key(self, stats):
+        if self.is_healthy(stats):
+            return False, stats.latency
+
+        return True, stats.failure_rate
+
+    # Returns backends (given in the order to prefer while nothing is known) in the order they
+    # should be tried for method.
+    def get_order(self, method, backends):
+        with self.lock:
+            stats = {backend: self.stats.get((method, backend)) or BackendStats() for backend in backends}
+
+        # Not measured enough yet, in the given order.
+        order = [backend for backend in backends if stats[backend].samples < self.min_samples]
+        if order:
+            return order + [backend for backend in backends if backend not in order]
+
+        order = sorted(backends, key=lambda backend: self.get_sort_key(stats[backend]))
+
+        if len(order) > 1 and random.random() < self.exploration:
+            order.insert(0, order.pop(random.randrange(1, len(order))))
+
+        return order
+
+    def record(self, method, backend, latency, failed=False):
+        with self.lock:
+            stats = self.stats.get((method, backend))
+
+            if stats is None:
+                stats = self.stats[(method, backend)] = BackendStats()
+
+            stats.samples += 1
+            stats.failure_rate += self.smoothing * (failed - stats.failure_rate)
+
+            if not failed:
+                stats.latency = latency if stats.latency is None \
+                    else stats.latency + self.smoothing * (latency - stats.latency)
+
+        if failed:
+            logging.debug('{} failed for {}, which now fails {:.0%} of the time'.format(
+                backend, method, stats.failure_rate))
+
+    # One line per method and backend, e.g. for logging.
+    def describe(self):
+        with self.lock:
+            return ['{} via {}: {} calls, {} average, {:.0%} failed'.format(
+                method, backend, stats.samples,
+                '-' if stats.latency is None else '{:.1f} ms'.format(stats.latency * 1000), stats.failure_rate)
+                for (method, backend), stats in sorted(self.stats.items())]
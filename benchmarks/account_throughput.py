@@ -0,0 +1,88 @@
+# Measures how command throughput scales with the number of accounts, each running its commands
+# sequentially (like a method group queue does) against the local mock API.
+#
+#   python benchmarks/account_throughput.py --latency 0.05 --commands 40
+#
+# With --slow-refresh, the first account's token has expired and its refresh takes that many
+# seconds, which shouldn't change how long the other accounts take.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+from spotify import Spotify, config  # noqa: E402
+
+# Only the commands themselves should be making requests.
+config['prefetch']['enabled'] = 'false'
+config['monthly_playlist']['precreate'] = 'false'
+
+
+def run_account(spotify, commands, finished_at, index):
+    for _ in range(commands):
+        spotify.is_playing()
+
+    finished_at[index] = time.perf_counter()
+
+
+def run(account_count, commands, latency, slow_refresh):
+    mock = MockSpotifyApi(latency=latency, refresh_latency=slow_refresh).start()
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        accounts = [None] + ['account{}'.format(i) for i in range(1, account_count)]
+
+        spotifies = []
+        for account in accounts:
+            write_account_tokens(info_dir, account)
+            spotify = Spotify(account)
+            mock.attach(spotify.web_api)
+            spotifies.append(spotify)
+
+        if slow_refresh:
+            spotifies[0].web_api.expiry_time = 0
+
+        finished_at = [0.0] * account_count
+        threads = [threading.Thread(target=run_account, args=(spotify, commands, finished_at, i))
+                   for i, spotify in enumerate(spotifies)]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    mock.stop()
+
+    return account_count * commands / elapsed, [t - start for t in finished_at]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--commands', type=int, default=40, help='commands per account')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to each mock API request')
+    parser.add_argument('--slow-refresh', type=float, default=0.0)
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>8}  {}'.format('accounts', 'commands/s', 'scaling', 'seconds per account'))
+
+    baseline = None
+    for account_count in args.accounts:
+        throughput, finish_times = run(account_count, args.commands, args.latency, args.slow_refresh)
+        baseline = baseline or throughput / account_count
+
+        print('{:>8} {:>12.1f} {:>7.2f}x  {}'.format(account_count, throughput, throughput / baseline,
+                                                     ' '.join('{:.2f}'.format(t) for t in finish_times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Measures logging in and refreshing tokens with each auth backend, against the local stand-in
+# for Spotify's authorization server and the relay.
+#
+#   python benchmarks/auth_flow.py --relay-latency 0.15 --latency 0.05 --login-delay 1
+#
+# The stand-in user takes login_delay seconds to log in once the authorization url is opened, so
+# anything above that is what the app adds: the relay's polling, or the loopback redirect and
+# code exchange.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import auth  # noqa: E402
+import web_api  # noqa: E402
+from web_api import WebApi  # noqa: E402
+
+scope_list = ['user-library-read', 'user-library-modify', 'playlist-modify-public', 'user-modify-playback-state',
+              'user-read-playback-state', 'playlist-modify-private']
+
+
+def open_in_browser(url):
+    threading.Thread(target=requests.get, args=(url,), daemon=True).start()
+
+
+def run(backend, mock, refreshes, port):
+    web_api.config['authentication']['backend'] = backend
+    web_api.config['authentication']['loopback_port'] = str(port)
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        write_account_tokens(info_dir, auth_backend=backend)
+        api = WebApi(scope_list, 'mockclient')
+        mock.attach(api)
+
+        start = time.perf_counter()
+        api.get_auth_info()
+        login = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(refreshes):
+            api.refresh_tokens()
+        refresh = (time.perf_counter() - start) / refreshes
+
+    print('{:>6} {:>10.0f} {:>12.1f}'.format(backend, login * 1000, refresh * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds Spotify's token endpoint takes")
+    parser.add_argument('--relay-latency', type=float, default=0.15, help='seconds the relay adds')
+    parser.add_argument('--refreshes', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--login-delay', type=float, default=1.0)
+    args = parser.parse_args()
+
+    auth.webbrowser.open_new = open_in_browser
+    auth.send_notif = lambda *args: None  # No desktop to show notifications on
+
+    mock = MockSpotifyApi(refresh_latency=args.latency, relay_latency=args.relay_latency,
+                          login_delay=args.login_delay).start()
+
+    print('{:>6} {:>10} {:>12}'.format('auth', 'login ms', 'refresh ms'))
+    for backend in ('relay', 'pkce'):
+        run(backend, mock, args.refreshes, args.port)
+
+    mock.stop()
+
+
+if __name__ == '__main__':
+    main()
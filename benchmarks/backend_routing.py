@@ -0,0 +1,94 @@
+# Compares always trying the local API first with routing each method to whichever backend has
+# been fastest, against a stand-in for AppleScript which takes call_cost seconds per osascript
+# call (get_current_track makes four) and can be made to fail some of the time.
+#
+#   python benchmarks/backend_routing.py --calls 200 --call-cost 0.03 --latency 0.02
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+from backend_router import BackendRouter  # noqa: E402
+from models import Track  # noqa: E402
+from spotify import Spotify, config  # noqa: E402
+
+config['prefetch']['enabled'] = 'false'
+config['monthly_playlist']['precreate'] = 'false'
+config['play_history']['enabled'] = 'false'
+
+
+class SimulatedAppleScriptApi:
+
+    def __init__(self, call_cost, failure_rate):
+        self.call_cost = call_cost
+        self.failure_rate = failure_rate
+
+    def run_command(self):
+        time.sleep(self.call_cost)
+
+        if random.random() < self.failure_rate:
+            raise AttributeError
+
+    def get_current_track(self):
+        for _ in range(4):
+            self.run_command()
+
+        return Track(None, 'name', ['artist'], 'album', [None])
+
+    def next(self):
+        self.run_command()
+
+
+def run(routing, calls, call_cost, latency, failure_rate):
+    mock = MockSpotifyApi(latency=latency).start()
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        write_account_tokens(info_dir)
+        spotify = Spotify()
+        mock.attach(spotify.web_api)
+
+        spotify.local_api = SimulatedAppleScriptApi(call_cost, failure_rate)
+        spotify.backend_router = BackendRouter() if routing else None
+
+        results = []
+        for name, command in (('get_current_track', spotify.get_current_track),
+                              ('next', lambda: spotify.try_local_method_then_web('next', 'me/player/next',
+                                                                                  'post'))):
+            start = time.perf_counter()
+            for _ in range(calls):
+                command()
+            results.append((name, (time.perf_counter() - start) / calls))
+
+    mock.stop()
+
+    for name, elapsed in results:
+        print('{:>8} {:>18} {:>10.1f}'.format('routed' if routing else 'local', name, elapsed * 1000))
+
+    if routing:
+        print('\n'.join('  ' + line for line in spotify.backend_router.describe()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--call-cost', type=float, default=0.03)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    print('{:>8} {:>18} {:>10}'.format('backend', 'command', 'ms/call'))
+    for routing in (False, True):
+        run(routing, args.calls, args.call_cost, args.latency, args.failure_rate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Measures how long a key press takes to be matched to its method, with the keyboard listener
+# in this process (as a thread) and in its own process, while worker threads keep the GIL busy
+# decoding responses like commands do.
+#
+#   python benchmarks/listener_latency.py --presses 200 --workers 4
+#
+# Presses are synthetic (pynput isn't listening to anything), sent at fixed times so the latency
+# is from when the press happened to when its method was matched, and to when this process
+# received it (which is the same thing in-process).
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+from chord_matcher import ChordMatcher  # noqa: E402
+from listener_process import ListenerProcess  # noqa: E402
+
+BINDING = 'q+w'
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'playlist_tracks.json')
+
+
+def write_bindings(file):
+    with open(file, 'w') as f:
+        f.write('play_pause={}\n'.format(BINDING))
+
+
+# Presses the binding every interval seconds, starting at start (a time.monotonic(), which is
+# the same clock in every process), handing each press to on_press with the time it happened.
+def press_keys(on_press, on_release, presses, interval, start):
+    keys = [ChordMatcher.get_key_from_string(key) for key in BINDING.split('+')]
+
+    for i in range(presses):
+        pressed_at = start + i * interval
+        time.sleep(max(0, pressed_at - time.monotonic()))
+
+        for key in keys:
+            on_press(key, pressed_at)
+        for key in reversed(keys):
+            on_release(key)
+
+
+def run_matcher(on_match, bindings_file, presses, interval, start):
+    pressed_at = [0.0]
+    matcher = ChordMatcher(lambda method: on_match((method, pressed_at[0], time.monotonic())))
+    matcher.load_bindings_from_file(bindings_file)
+
+    def on_press(key, at):
+        pressed_at[0] = at
+        matcher.on_press(key)
+
+    press_keys(on_press, matcher.on_release, presses, interval, start)
+
+
+def decode_forever(stop):
+    with open(FIXTURE, 'rb') as f:
+        content = f.read()
+
+    while not stop.is_set():
+        json.loads(content)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(separate_process, workers, presses, interval, bindings_file):
+    stop = threading.Event()
+    threads = [threading.Thread(target=decode_forever, args=(stop,), daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    results = []
+    done = threading.Event()
+
+    def on_match(result):
+        received_at = time.monotonic()
+        method, pressed_at, matched_at = result
+        results.append((matched_at - pressed_at, received_at - pressed_at))
+
+        if len(results) == presses:
+            done.set()
+
+    start = time.monotonic() + (2 if separate_process else 0.2)
+
+    if separate_process:
+        listener = ListenerProcess(on_match, bindings_file, (),
+                                   target=(os.path.abspath(__file__), 'press_in_child', (presses, interval, start)))
+        listener.start()
+    else:
+        listener = None
+        threading.Thread(target=run_matcher, args=(on_match, bindings_file, presses, interval, start),
+                         daemon=True).start()
+
+    done.wait(start - time.monotonic() + presses * interval + 30)
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    if listener is not None:
+        listener.stop()
+
+    matched = [r[0] * 1000 for r in results]
+    received = [r[1] * 1000 for r in results]
+
+    print('{:>13} {:>7} {:>6}   matched p50 {:7.2f} ms  p99 {:7.2f} ms   received p50 {:7.2f} ms  p99 {:7.2f} ms'
+          .format('process' if separate_process else 'thread', workers, len(results),
+                  percentile(matched, 0.5), percentile(matched, 0.99),
+                  percentile(received, 0.5), percentile(received, 0.99)))
+
+
+# Child process target, in place of listener_process.listen, pressing keys instead of listening.
+def press_in_child(send, bindings_file, repeatable_methods, presses, interval, start):
+    run_matcher(send, bindings_file, presses, interval, start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--presses', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    bindings_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'listener_latency_bindings.txt')
+    write_bindings(bindings_file)
+
+    print('{:>13} {:>7} {:>6}'.format('listener', 'workers', 'presses'))
+    try:
+        for workers in (0, args.workers):
+            for separate_process in (False, True):
+                run(separate_process, workers, args.presses, args.interval, bindings_file)
+    finally:
+        os.remove(bindings_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# Times the CPU-bound paths every key press or command goes through, in nanoseconds per event,
+# and compares them with the baselines in baselines.json, failing if any got slower by more
+# than the threshold. Nothing here waits on the network: responses are built from fixtures/.
+#
+#   python benchmarks/microbenchmarks.py                  # compare with the baselines
+#   python benchmarks/microbenchmarks.py --save           # record new baselines
+#   python benchmarks/microbenchmarks.py --only on_press  # run the benchmarks with this in their name
+#
+# CI runs it without --save, which exits with 1 on a regression.
+#
+# Machines (and the same machine from one minute to the next) run at different speeds, so each
+# result is compared as a multiple of a calibration loop timed right before it, and the median
+# of several runs is kept. Baselines are still best recorded on the machine that runs them.
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+from mock_api import load_fixture, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+from spotify import config  # noqa: E402
+
+config['prefetch']['enabled'] = 'false'
+config['monthly_playlist']['precreate'] = 'false'
+config['control']['enabled'] = 'false'
+
+from chord_matcher import ChordMatcher  # noqa: E402
+from spotify_helper import SpotifyHelper  # noqa: E402
+from web_api import open_shelf  # noqa: E402
+
+baselines_file = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Only character keys, which are told apart by every pynput backend.
+keys = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def write_bindings(file, count):
+    with open(file, 'w') as f:
+        for i in range(count):
+            chord = '+'.join(keys[(i + j * 7) % len(keys)] for j in range(1 + i % 3))
+            f.write('{}={}  # binding {}\n'.format('toggle_save' if i % 2 else 'next', chord, i))
+
+
+def make_response(content):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content
+    response.encoding = 'utf-8'
+
+    return response
+
+
+# Doesn't run anything it queues, so only the routing itself is timed.
+class QueueingSpotifyHelper(SpotifyHelper):
+
+    def start_queue_listening_thread(self, queue, name):
+        pass
+
+
+class Benchmarks:
+
+    def __init__(self, info_dir):
+        write_account_tokens(info_dir)
+
+        self.bindings_file = os.path.join(info_dir, 'bindings.txt')
+        write_bindings(self.bindings_file, 100)
+        self.large_bindings_file = os.path.join(info_dir, 'large_bindings.txt')
+        write_bindings(self.large_bindings_file, 5000)
+
+        self.helper = QueueingSpotifyHelper()
+        self.helper.chord_matcher = ChordMatcher(lambda method: None)
+        self.helper.load_bindings_from_file(self.bindings_file)
+
+        self.spotify = self.helper.spotify
+        with open_shelf(self.spotify.web_api.info_file) as shelf:
+            shelf['monthly_playlist_ids'] = {time.strftime('%B %Y'): '37i9dQZF1DXcBWIGoYBM5M'}
+        self.fixtures = {name: load_fixture(name) for name in ('playback', 'playlist_tracks')}
+
+    # Each returns (what to run for every event, how many events per call).
+
+    def on_press_unbound(self):
+        press_keys = [ChordMatcher.get_key_from_string(key) for key in 'qwerty']
+
+        def run():
+            for key in press_keys:
+                self.helper.on_press(key)
+                self.helper.on_release(key)
+
+        return run, len(press_keys)
+
+    def on_press_chord(self):
+        chord = [ChordMatcher.get_key_from_string(key) for key in 'ahov']  # The 4th binding
+
+        def run():
+            for key in chord:
+                self.helper.on_press(key)
+            for key in chord:
+                self.helper.on_release(key)
+
+        return run, 1
+
+    def load_bindings_from_file(self):
+        def run():
+            ChordMatcher(lambda method: None).load_bindings_from_file(self.large_bindings_file)
+
+        return run, 5000
+
+    def queue_method(self):
+        queue = self.helper.method_group_thread_queues[None]['save_dependent']
+
+        def run():
+            self.helper.queue_method('toggle_save')
+            queue.queue.clear()
+
+        return run, 1
+
+    # A new response every time, as a response's body is only ever decoded once.
+    def respond_with(self, fixture):
+        content = self.fixtures[fixture]
+        self.spotify.web_api.get = lambda endpoint, params=None, timeout=4: make_response(content)
+
+    def call_web_method_playback(self):
+        self.respond_with('playback')
+
+        def run():
+            self.spotify.get_playback_state()
+
+        return run, 1
+
+    def call_web_method_playlist_tracks(self):
+        self.respond_with('playlist_tracks')
+
+        def run():
+            self.spotify.fetch_is_in_monthly_playlist('notinplaylist', 0)
+
+        return run, 1
+
+    def currently_playing_art_url(self):
+        self.respond_with('playback')
+
+        def run():
+            self.spotify.currently_playing_art_url()
+
+        return run, 1
+
+    names = ['on_press_unbound', 'on_press_chord', 'load_bindings_from_file', 'queue_method',
+             'call_web_method_playback', 'call_web_method_playlist_tracks', 'currently_playing_art_url']
+
+
+# Plain Python, like the code being measured, to tell how fast the machine is running right now.
+def calibration():
+    def run():
+        total = 0
+        for i in range(1000):
+            total += len(str(i)) + {'key': i}.get('key')
+
+    return run, 1000
+
+
+# The best of several rounds, each running for about round_time seconds, as anything slower
+# than that was only slowed down by something else. Like timeit, the garbage collector is
+# kept out of the way.
+def measure(run, events_per_call, rounds=7, round_time=0.2):
+    gc.collect()
+    gc.disable()
+
+    try:
+        return measure_rounds(run, events_per_call, rounds, round_time)
+    finally:
+        gc.enable()
+
+
+def measure_rounds(run, events_per_call, rounds, round_time):
+    calls = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            run()
+        elapsed = time.perf_counter_ns() - start
+
+        if elapsed > round_time * 1e9 / 10:
+            break
+        calls *= 10
+
+    calls = max(1, int(calls * round_time * 1e9 / elapsed))
+    best = None
+
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for _ in range(calls):
+            run()
+        elapsed = time.perf_counter_ns() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best / (calls * events_per_call)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', action='store_true', help='record the results as the new baselines')
+    parser.add_argument('--threshold', type=float, default=0.35,
+                        help='fail if anything is this much slower than its baseline, relative to the calibration '
+                             'loop (0.35 is 35%%)')
+    parser.add_argument('--only', default='')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='run each benchmark this many times, keeping the median (less noisy on busy machines)')
+    args = parser.parse_args()
+
+    try:
+        with open(baselines_file) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    results = {}
+    regressions = []
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        benchmarks = Benchmarks(info_dir)
+
+        results['calibration'] = round(statistics.median(measure(*calibration()) for _ in range(args.repeat)), 1)
+        baseline_calibration = baselines.get('calibration')
+
+        # Saving only some benchmarks keeps the others' calibration.
+        saved_calibration = results['calibration']
+        if args.only and baseline_calibration is not None:
+            saved_calibration = baseline_calibration
+            del results['calibration']
+
+        print('{:>34} {:>14} {:>14} {:>8}'.format('benchmark', 'ns/event', 'baseline', 'change'))
+        print('{:>34} {:>14,.1f} {:>14} {:>8}'.format('calibration', saved_calibration,
+                                                      '-' if baseline_calibration is None
+                                                      else '{:,.1f}'.format(baseline_calibration), ''))
+        for name in Benchmarks.names:
+            if args.only not in name:
+                continue
+
+            # As multiples of the calibration loop timed just before, and in ns at the calibration
+            # loop's speed when saved.
+            relative = statistics.median(measure(*getattr(benchmarks, name)()) / measure(*calibration())
+                                         for _ in range(args.repeat))
+            ns = relative * saved_calibration
+            results[name] = round(ns, 1)
+            baseline = baselines.get(name)
+
+            if baseline is None or baseline_calibration is None:
+                print('{:>34} {:>14,.1f} {:>14} {:>8}'.format(name, ns, '-', ''))
+                continue
+
+            change = relative / (baseline / baseline_calibration) - 1
+            print('{:>34} {:>14,.1f} {:>14,.1f} {:>+7.1%}'.format(name, ns, baseline, change))
+
+            if change > args.threshold:
+                regressions.append(name)
+
+    if args.save:
+        baselines.update(results)
+
+        with open(baselines_file, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+        print('Saved baselines to {}'.format(baselines_file))
+    elif regressions:
+        print('Slower than baseline by more than {:.0%}: {}'.format(args.threshold, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
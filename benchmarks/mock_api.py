@@ -0,0 +1,241 @@
+# A local stand-in for the Spotify Web API, its authorization server and the token relay,
+# serving the recorded payloads in fixtures/, so benchmarks and soak tests don't touch the
+# real services.
+import base64
+import hashlib
+import json
+import os
+import re
+import shelve
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import web_api  # noqa: E402
+
+fixtures_dir = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+all_scopes = ['user-library-read', 'user-library-modify', 'playlist-modify-public', 'user-modify-playback-state',
+              'user-read-playback-state', 'playlist-modify-private']
+
+
+def load_fixture(name):
+    with open(os.path.join(fixtures_dir, name + '.json'), 'rb') as file:
+        return file.read()
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Otherwise headers and body go out separately, and Nagle's algorithm adds ~40ms to every request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    get_routes = [
+        (re.compile(r'^/v1/me/player$'), 'playback'),
+        (re.compile(r'^/v1/me/player/devices$'), 'devices'),
+        (re.compile(r'^/v1/me$'), 'me'),
+        (re.compile(r'^/v1/me/playlists$'), 'playlists'),
+        (re.compile(r'^/v1/playlists/[^/]+/tracks$'), 'playlist_tracks'),
+        (re.compile(r'^/v1/tracks/[^/]+$'), 'track'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body=b'', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+        self.server.mock.record_body(body)
+
+    # Like Spotify, answers with a 304 and no body if the client already has this version.
+    def send_fixture(self, name):
+        body = self.server.mock.fixtures[name]
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+
+        if self.headers.get('If-None-Match') == etag:
+            return self.send_body(304, etag=etag)
+
+        self.send_body(200, body, etag)
+
+    def send_tokens(self):
+        self.send_body(200, json.dumps({'access_token': uuid.uuid4().hex, 'refresh_token': uuid.uuid4().hex,
+                                        'expires_in': 3600, 'scope': ' '.join(all_scopes)}).encode())
+
+    # The user 'logs in' login_delay seconds after the authorization url is first opened. Loopback
+    # redirect uris are then redirected to, like Spotify does, while for the relay's the login is
+    # only remembered for /users/complete.
+    def authorize(self, query):
+        mock = self.server.mock
+
+        with mock.lock:
+            logged_in_at = mock.logged_in_at.setdefault(query.get('state'), time.monotonic() + mock.login_delay)
+
+        if not query.get('redirect_uri', '').startswith('http://127.0.0.1'):
+            return self.send_body(200)
+
+        time.sleep(max(0, logged_in_at - time.monotonic()))
+
+        code = uuid.uuid4().hex
+        with mock.lock:
+            mock.code_challenges[code] = query.get('code_challenge')
+
+        self.send_response(302)
+        self.send_header('Location', query['redirect_uri'] + '?' + urlencode({'code': code, 'state': query['state']}))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # Checks the code's verifier like Spotify would, for the PKCE flow.
+    def exchange_token(self, form):
+        time.sleep(self.server.mock.refresh_latency)
+
+        if form.get('grant_type') == 'refresh_token':
+            return self.send_tokens()
+
+        with self.server.mock.lock:
+            code_challenge = self.server.mock.code_challenges.pop(form.get('code'), None)
+
+        digest = hashlib.sha256(form.get('code_verifier', '').encode()).digest()
+        if code_challenge is None or base64.urlsafe_b64encode(digest).rstrip(b'=').decode() != code_challenge:
+            return self.send_body(400, b'{"error": "invalid_grant"}')
+
+        self.send_tokens()
+
+    def handle_request(self):
+        self.server.mock.record(self)
+        # Bodies have to be read for the connection to be reused.
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        url = urlparse(self.path)
+        path = url.path
+
+        if path == '/authorize':
+            return self.authorize({key: values[0] for key, values in parse_qs(url.query).items()})
+
+        if path == '/api/token':
+            return self.exchange_token({key: values[0] for key, values in parse_qs(body.decode()).items()})
+
+        # The relay's, which also has to ask Spotify, so takes relay_latency longer.
+        if path == '/users/refresh':
+            time.sleep(self.server.mock.relay_latency + self.server.mock.refresh_latency)
+            return self.send_tokens()
+
+        if path == '/users/complete':
+            time.sleep(self.server.mock.relay_latency)
+
+            with self.server.mock.lock:
+                logged_in_at = self.server.mock.logged_in_at.get(json.loads(body).get('uuid'))
+
+            if logged_in_at is None or time.monotonic() < logged_in_at:
+                return self.send_body(404)
+
+            return self.send_tokens()
+
+        time.sleep(self.server.mock.latency)
+
+        if self.command == 'GET':
+            if path == '/v1/me/tracks/contains':
+                return self.send_body(200, b'[false]')
+
+            for route, fixture in self.get_routes:
+                if route.match(path):
+                    return self.send_fixture(fixture)
+
+            return self.send_body(404, b'{"error": {"status": 404, "message": "Not found"}}')
+
+        if self.command == 'POST' and path.endswith('/playlists'):
+            return self.send_body(201, b'{"id": "mockplaylist"}')
+
+        self.send_body(204)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+
+class MockSpotifyApi:
+
+    # latency is added to every Web API request, and refresh_latency to every token refresh.
+    # Requests to the relay take relay_latency on top, and logging in takes login_delay.
+    def __init__(self, latency=0.0, refresh_latency=0.0, relay_latency=0.0, login_delay=0.0):
+        self.latency = latency
+        self.refresh_latency = refresh_latency
+        self.relay_latency = relay_latency
+        self.login_delay = login_delay
+
+        self.logged_in_at = {}
+        self.code_challenges = {}
+
+        self.fixtures = {name: load_fixture(name)
+                         for name in ('playback', 'devices', 'me', 'playlists', 'playlist_tracks')}
+        self.fixtures['track'] = json.dumps(json.loads(self.fixtures['playback'])['item']).encode()
+
+        self.request_count = 0
+        self.requests_by_path = {}
+        self.body_bytes = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MockRequestHandler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    @property
+    def api_url(self):
+        return self.url + '/v1/'
+
+    @property
+    def refresh_token_url(self):
+        return self.url + '/users/refresh'
+
+    def record(self, handler):
+        key = '{} {}'.format(handler.command, urlparse(handler.path).path)
+
+        with self.lock:
+            self.request_count += 1
+            self.requests_by_path[key] = self.requests_by_path.get(key, 0) + 1
+
+    def record_body(self, body):
+        with self.lock:
+            self.body_bytes += len(body)
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Points a WebApi at this server instead of Spotify's.
+    def attach(self, api):
+        api.api_url = self.api_url
+        api.refresh_token_url = self.refresh_token_url
+        api.register_user_url = self.url + '/users/complete'
+        api.authorize_access_url = self.url + '/authorize'
+        api.token_url = self.url + '/api/token'
+
+
+# Saves tokens for an account, as if it had already logged in, and points web_api at info_dir
+# so the account's WebApi finds them.
+def write_account_tokens(info_dir, account=None, expires_in=3600, auth_backend='relay'):
+    web_api.info_dir = info_dir
+
+    with shelve.open(web_api.get_info_file(account)) as shelf:
+        shelf['uuid'] = uuid.uuid4()
+        shelf['access_token'] = uuid.uuid4().hex
+        shelf['refresh_token'] = uuid.uuid4().hex
+        shelf['expiry_time'] = time.time() + expires_in
+        shelf['auth_backend'] = auth_backend
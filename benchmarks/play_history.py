@@ -0,0 +1,85 @@
+# Measures the play history's size on disk, how long it takes to load, and how long its queries
+# take, for a synthetic year of listening.
+#
+#   python benchmarks/play_history.py --plays-per-day 140 --tracks 20000
+import argparse
+import datetime
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from play_history import PlayHistory  # noqa: E402
+
+
+def make_id():
+    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(22))
+
+
+def get_size(history):
+    return (os.path.getsize(history.file) + os.path.getsize(history.get_strings_file(history.generation))) / 1e6
+
+
+def time_query(query, repeat=1000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        query()
+
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plays-per-day', type=int, default=140)
+    parser.add_argument('--tracks', type=int, default=20000, help='different tracks in the year')
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+
+    track_ids = [make_id() for _ in range(args.tracks)]
+    contexts = ['spotify:playlist:' + make_id() for _ in range(300)] + ['spotify:album:' + make_id() for _ in range(700)]
+    devices = [make_id() + make_id() for _ in range(3)]
+
+    plays = args.plays_per_day * args.days
+    start_time = time.time() - args.days * 24 * 60 * 60
+
+    with tempfile.TemporaryDirectory() as directory:
+        file = os.path.join(directory, '.history')
+
+        history = PlayHistory(file)
+        start = time.perf_counter()
+        for i in range(plays):
+            history.observe(random.choice(track_ids), random.choice(contexts), random.choice(devices),
+                            start_time + i * args.days * 24 * 60 * 60 / plays)
+        record_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        history = PlayHistory(file)
+        load_time = time.perf_counter() - start
+
+        month_start = datetime.datetime.now().replace(day=1, hour=0, minute=0, second=0).timestamp()
+
+        print('{} plays of {} tracks: {:.2f} MB on disk'.format(len(history.times), len(track_ids), get_size(history)))
+        print('record:  {:8.1f} us per play'.format(record_time / plays * 1e6))
+        print('load:    {:8.1f} ms'.format(load_time * 1000))
+        print('get_last(10):               {:8.1f} us'.format(time_query(lambda: history.get_last(10))))
+        print('get_recent_plays(2):        {:8.1f} us'.format(time_query(lambda: history.get_recent_plays(2))))
+        print('get_recent_plays(10):       {:8.1f} us'.format(time_query(lambda: history.get_recent_plays(10))))
+        print('get_between(this month):    {:8.1f} us ({} plays)'.format(
+            time_query(lambda: history.get_between(month_start), repeat=100), len(history.get_between(month_start))))
+
+        history.retention = args.days / 2 * 24 * 60 * 60
+        start = time.perf_counter()
+        history.compact()
+        print('compact to half a year:     {:8.1f} ms, {:.2f} MB on disk'.format(
+            (time.perf_counter() - start) * 1000, get_size(history)))
+
+        reloaded = PlayHistory(file)
+        assert reloaded.get_last(50)[-1].track_id == history.get_last(50)[-1].track_id
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Measures how much the sampling profiler slows down threads decoding responses (as commands
+# do) while it runs, and shows the heaviest stacks it found.
+#
+#   python benchmarks/profiler_overhead.py --threads 4 --seconds 3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from mock_api import load_fixture
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from profiler import SamplingProfiler  # noqa: E402
+
+
+def decode_until(content, stop, counts, index):
+    while not stop.is_set():
+        json.loads(content)
+        counts[index] += 1
+
+
+def run(threads, seconds, profiler):
+    content = load_fixture('playlist_tracks')
+    stop = threading.Event()
+    counts = [0] * threads
+    workers = [threading.Thread(target=decode_until, args=(content, stop, counts, i), name='decoder-{}'.format(i))
+               for i in range(threads)]
+
+    if profiler is not None:
+        profiler.start()
+
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+
+    file = profiler.stop() if profiler is not None else None
+
+    return sum(counts) / seconds, file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--interval', type=float, default=0.005)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        off, _ = run(args.threads, args.seconds, None)
+        on, file = run(args.threads, args.seconds, SamplingProfiler(directory, args.interval))
+
+        print('decodes/s  profiler off: {:.0f}  on: {:.0f}  ({:+.1%})'.format(off, on, on / off - 1))
+
+        with open(file) as f:
+            lines = f.readlines()
+
+        print('{} distinct stacks in {}, heaviest:'.format(len(lines), os.path.basename(file)))
+        for line in lines[:3]:
+            print('  ' + line.rstrip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Measures repeated lookups of rarely-changing resources with and without the response cache:
+# checking whether a track is in the monthly playlist (revalidated every time), and listing
+# playlists (used as is within its ttl).
+#
+#   python benchmarks/response_cache.py --lookups 50 --latency 0.02
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+import web_api  # noqa: E402
+from models import Paging  # noqa: E402
+from spotify import Spotify, config  # noqa: E402
+from web_api import open_shelf  # noqa: E402
+
+config['prefetch']['enabled'] = 'false'
+config['monthly_playlist']['precreate'] = 'false'
+
+
+def run(cache_enabled, lookups, latency):
+    web_api.config['response_cache']['enabled'] = str(cache_enabled).lower()
+    mock = MockSpotifyApi(latency=latency).start()
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        write_account_tokens(info_dir)
+        spotify = Spotify()
+        mock.attach(spotify.web_api)
+
+        with open_shelf(spotify.web_api.info_file) as shelf:
+            shelf['monthly_playlist_ids'] = {time.strftime('%B %Y'): '37i9dQZF1DXcBWIGoYBM5M'}
+
+        results = []
+        for name, lookup in (
+                ('is_in_monthly_playlist', lambda: spotify.fetch_is_in_monthly_playlist('notinplaylist', 0)),
+                ('me/playlists', lambda: spotify.call_web_method('me/playlists', 'get',
+                                                                 params={'limit': 50, 'offset': 0},
+                                                                 to_model=Paging.from_json))):
+            lookup()  # The first lookup has to fetch everything either way.
+
+            requests_before, bytes_before = mock.request_count, mock.body_bytes
+            start = time.perf_counter()
+            for _ in range(lookups):
+                lookup()
+            elapsed = time.perf_counter() - start
+
+            results.append((name, mock.request_count - requests_before, mock.body_bytes - bytes_before, elapsed))
+
+    mock.stop()
+
+    for name, request_count, body_bytes, elapsed in results:
+        print('{:>6} {:>24} {:>9} {:>12} {:>12.2f}'.format('on' if cache_enabled else 'off', name, request_count,
+                                                        body_bytes, elapsed / lookups * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lookups', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    print('{:>6} {:>24} {:>9} {:>12} {:>12}'.format('cache', 'lookup', 'requests', 'body bytes', 'ms/lookup'))
+    for cache_enabled in (False, True):
+        run(cache_enabled, args.lookups, args.latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+# Drives a long run of synthetic chords through SpotifyHelper, against the mock API (in its own
+# process, so it doesn't count towards what's measured), sampling the memory, threads, open file
+# descriptors, temporary files and queued commands of this process as it goes. Fails (exiting
+# with 1) as soon as any of them goes over its threshold, or if threads or queues don't go back
+# down once the chords stop.
+#
+#   python benchmarks/soak.py --chords 1000000 --bounded   # with [resources] bounded on
+#   python benchmarks/soak.py --chords 100000 --rate 50    # as if someone were typing very fast
+#
+# Without --bounded and --rate, chords come in much faster than commands can run, so the queues
+# grow until the run fails, which is what the bounded mode is for.
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+import notif_handler  # noqa: E402
+import spotify  # noqa: E402
+import spotify_helper  # noqa: E402
+from chord_matcher import ChordMatcher  # noqa: E402
+from spotify_helper import SpotifyHelper  # noqa: E402
+
+for module_config in (spotify.config, spotify_helper.config):
+    module_config['monthly_playlist']['precreate'] = 'false'
+    module_config['control']['enabled'] = 'false'
+
+# Only character keys, which are told apart by every pynput backend.
+bindings = {'next': 'a+s', 'toggle_save': 'd+f', 'show_current_song': 'g+h', 'volume_up': 'j+k',
+            'toggle_shuffle': 'l+z'}
+
+
+# No desktop to show notifications on, and album art comes from here rather than Spotify's CDN,
+# though notifications with art still go through a temporary file like they would.
+class ArtResponse:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def read(self):
+        return b'\xff' * 20000
+
+
+notif_handler.notify = lambda *args: None
+notif_handler.urlopen = lambda url, timeout: ArtResponse()
+
+
+def serve_mock(connection, latency):
+    mock = MockSpotifyApi(latency=latency).start()
+    connection.send(mock.url)
+    connection.recv()  # Until the run is over
+
+
+# Looks like a MockSpotifyApi to MockSpotifyApi.attach().
+class RemoteMock:
+
+    def __init__(self, url):
+        self.url = url
+        self.api_url = url + '/v1/'
+        self.refresh_token_url = url + '/users/refresh'
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Only the peak, on macOS in bytes
+
+
+def count_open_files():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+class Sample:
+    __slots__ = ('elapsed', 'chords', 'rss', 'threads', 'command_threads', 'open_files', 'temp_files', 'queued',
+                 'largest_queue', 'dropped')
+
+
+class Soak:
+
+    def __init__(self, helper, temp_dir):
+        self.helper = helper
+        self.temp_dir = temp_dir
+        self.start = time.monotonic()
+
+    def get_queues(self):
+        return [queue for queues in self.helper.method_group_thread_queues.values() for queue in queues.values()]
+
+    def sample(self, chords):
+        sample = Sample()
+        sample.elapsed = time.monotonic() - self.start
+        sample.chords = chords
+        sample.rss = get_rss()
+        sample.threads = threading.active_count()
+        sample.command_threads = sum(thread.name.startswith('command') for thread in threading.enumerate())
+        sample.open_files = count_open_files()
+        sample.temp_files = len(os.listdir(self.temp_dir))
+        sample.queued = sum(queue.qsize() for queue in self.get_queues())
+        sample.largest_queue = max(queue.qsize() for queue in self.get_queues())
+        sample.dropped = self.helper.dropped_count
+
+        print('{:>8.1f} {:>10} {:>8.1f} {:>8} {:>8} {:>6} {:>6} {:>8} {:>9}'.format(
+            sample.elapsed, sample.chords, sample.rss / 1e6, sample.threads, sample.command_threads,
+            '-' if sample.open_files is None else sample.open_files, sample.temp_files, sample.queued,
+            sample.dropped))
+
+        return sample
+
+    # Waits for queued commands, and the threads running them, to finish.
+    def drain(self, timeout, baseline):
+        until = time.monotonic() + timeout
+
+        while time.monotonic() < until:
+            if sum(queue.qsize() for queue in self.get_queues()) == 0 and threading.active_count() <= baseline.threads:
+                return
+
+            time.sleep(0.5)
+
+
+# Returns what went over its threshold in sample, compared to baseline.
+def check(sample, baseline, args):
+    failures = []
+
+    if sample.rss - baseline.rss > args.max_rss_growth * 1e6:
+        failures.append('memory grew by {:.1f} MB'.format((sample.rss - baseline.rss) / 1e6))
+    if sample.threads > args.max_threads:
+        failures.append('{} threads'.format(sample.threads))
+    if sample.open_files is not None and sample.open_files - baseline.open_files > args.max_open_file_growth:
+        failures.append('{} more open files'.format(sample.open_files - baseline.open_files))
+    if sample.temp_files > args.max_temp_files:
+        failures.append('{} temporary files'.format(sample.temp_files))
+    if sample.queued > args.max_queued:
+        failures.append('{} queued commands'.format(sample.queued))
+
+    # What bounded mode promises.
+    if args.bounded:
+        if sample.largest_queue > spotify_helper.config.getint('resources', 'queue_size'):
+            failures.append('a queue of {} commands'.format(sample.largest_queue))
+        if sample.command_threads > spotify_helper.config.getint('resources', 'command_threads'):
+            failures.append('{} command threads'.format(sample.command_threads))
+
+    return failures
+
+
+def press_chord(helper, keys):
+    for key in keys:
+        helper.on_press(key)
+    for key in reversed(keys):
+        helper.on_release(key)
+
+
+def run(args, info_dir, temp_dir):
+    helper = SpotifyHelper()
+    for account_spotify in helper.spotifies.values():
+        MockSpotifyApi.attach(RemoteMock(args.mock_url), account_spotify.web_api)
+
+    bindings_file = os.path.join(info_dir, 'bindings.txt')
+    with open(bindings_file, 'w') as f:
+        for method, chord in bindings.items():
+            f.write('{}={}\n'.format(method, chord))
+
+    helper.chord_matcher = ChordMatcher(helper.queue_method, helper.repeatable_methods)
+    helper.load_bindings_from_file(bindings_file)
+
+    chords = [[ChordMatcher.get_key_from_string(key) for key in chord.split('+')] for chord in bindings.values()]
+
+    soak = Soak(helper, temp_dir)
+    print('{:>8} {:>10} {:>8} {:>8} {:>8} {:>6} {:>6} {:>8} {:>9}'.format(
+        'seconds', 'chords', 'rss MB', 'threads', 'commands', 'fds', 'temp', 'queued', 'dropped'))
+
+    # Everything started lazily (connections, caches, prefetching) is running by then.
+    for i in range(args.warmup):
+        press_chord(helper, chords[i % len(chords)])
+    soak.drain(args.drain_timeout, soak.sample(args.warmup))
+    baseline = soak.sample(args.warmup)
+
+    sampled_at = time.monotonic()
+    started_at = time.monotonic()
+
+    for i in range(args.chords):
+        if args.rate:
+            time.sleep(max(0, started_at + i / args.rate - time.monotonic()))
+
+        press_chord(helper, chords[i % len(chords)])
+
+        if time.monotonic() - sampled_at > args.sample_interval:
+            sampled_at = time.monotonic()
+            failures = check(soak.sample(i + 1), baseline, args)
+
+            if failures:
+                return failures
+
+    # Once everything has run, only what was there to begin with should be left.
+    soak.drain(args.drain_timeout, baseline)
+    sample = soak.sample(args.chords)
+    failures = check(sample, baseline, args)
+
+    if sample.queued > 0:
+        failures.append('{} commands still queued after {} seconds'.format(sample.queued, args.drain_timeout))
+    if sample.threads > baseline.threads:
+        failures.append('{} threads left running, from {}'.format(sample.threads, baseline.threads))
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chords', type=int, default=1000000)
+    parser.add_argument('--rate', type=float, default=0, help='chords per second (0 for as fast as possible)')
+    parser.add_argument('--bounded', action='store_true', help='turn on [resources] bounded')
+    parser.add_argument('--latency', type=float, default=0.005, help='of every mock API request, in seconds')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--sample-interval', type=float, default=5)
+    parser.add_argument('--drain-timeout', type=float, default=120)
+    parser.add_argument('--max-rss-growth', type=float, default=50, help='in MB')
+    parser.add_argument('--max-threads', type=int, default=64)
+    parser.add_argument('--max-open-file-growth', type=int, default=20)
+    parser.add_argument('--max-temp-files', type=int, default=10)
+    parser.add_argument('--max-queued', type=int, default=1000)
+    args = parser.parse_args()
+
+    for module_config in (spotify.config, spotify_helper.config):
+        module_config['resources']['bounded'] = str(args.bounded).lower()
+
+    receiving_end, sending_end = multiprocessing.Pipe()
+    mock_process = multiprocessing.Process(target=serve_mock, args=(sending_end, args.latency), daemon=True)
+    mock_process.start()
+    args.mock_url = receiving_end.recv()
+
+    info_dir = tempfile.mkdtemp()
+    write_account_tokens(info_dir)
+
+    # Notifications' temporary files end up here, where they can be counted.
+    tempfile.tempdir = os.path.join(info_dir, 'tmp')
+    os.mkdir(tempfile.tempdir)
+
+    failures = run(args, info_dir, tempfile.tempdir)
+
+    receiving_end.send(None)
+    mock_process.join()
+
+    # Commands may still be running, so what they use is left alone.
+    if failures:
+        print('Failed: {}'.format(', '.join(failures)))
+        print('Left {} as it was'.format(info_dir))
+        sys.exit(1)
+
+    tempfile.tempdir = None
+    shutil.rmtree(info_dir)
+
+    print('Passed')
+
+
+if __name__ == '__main__':
+    main()
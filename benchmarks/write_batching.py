@@ -0,0 +1,84 @@
+# Saves (and adds to the monthly playlist) a run of different tracks, as when curating while
+# skipping through them, with and without write batching, counting the writes that reach the
+# mock API and how long each command takes. Every fourth track is unsaved again straight away.
+#
+#   python benchmarks/write_batching.py --tracks 120 --latency 0.02
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from mock_api import MockSpotifyApi, write_account_tokens
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# On CI machines without a display.
+os.environ.setdefault('PYNPUT_BACKEND', 'dummy')
+
+import spotify as spotify_module  # noqa: E402
+from spotify import Spotify, config  # noqa: E402
+from web_api import open_shelf  # noqa: E402
+
+config['prefetch']['enabled'] = 'false'
+config['monthly_playlist']['precreate'] = 'false'
+config['play_history']['enabled'] = 'false'
+
+# No desktop to show notifications on.
+spotify_module.send_notif = spotify_module.send_notif_with_web_image = lambda *args: None
+
+
+def run(batching, track_count, latency):
+    config['write_batching']['enabled'] = str(batching).lower()
+    mock = MockSpotifyApi(latency=latency).start()
+
+    with tempfile.TemporaryDirectory() as info_dir:
+        write_account_tokens(info_dir)
+        spotify = Spotify()
+        mock.attach(spotify.web_api)
+
+        with open_shelf(spotify.web_api.info_file) as shelf:
+            shelf['monthly_playlist_ids'] = {time.strftime('%B %Y'): '37i9dQZF1DXcBWIGoYBM5M'}
+        spotify.get_user_id()
+
+        track_ids = ['{:022d}'.format(i) for i in range(track_count)]
+        current = [None]
+        spotify.get_current_song_id = lambda: current[0]
+
+        before = dict(mock.requests_by_path)
+        start = time.perf_counter()
+
+        for i, track_id in enumerate(track_ids):
+            current[0] = track_id
+            spotify.save()
+            spotify.toggle_save_monthly_playlist()
+
+            if i % 4 == 3:
+                spotify.unsave()
+
+        elapsed = time.perf_counter() - start
+
+        if spotify.write_batcher is not None:
+            spotify.write_batcher.flush()
+
+        writes = sum(count - before.get(key, 0) for key, count in mock.requests_by_path.items()
+                     if not key.startswith('GET'))
+
+    mock.stop()
+
+    print('{:>9} {:>8} {:>14.1f}'.format('on' if batching else 'off', writes, elapsed / track_count / 3 * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=120)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    print('{:>9} {:>8} {:>14}'.format('batching', 'writes', 'ms/command'))
+    for batching in (False, True):
+        run(batching, args.tracks, args.latency)
+
+
+if __name__ == '__main__':
+    main()
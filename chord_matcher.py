@@ -0,0 +1,98 @@
+# Matches key presses against the bindings in bindings.txt. Kept apart from the rest of the app,
+# so the keyboard listener can run in its own process with nothing else in it.
+from pynput.keyboard import Key, KeyCode
+
+
+class ChordMatcher:
+
+    # on_match(method) is called for every method bound to a chord as soon as it is pressed, and
+    # again on every repeated press while it is held if it is one of repeatable_methods.
+    def __init__(self, on_match, repeatable_methods=()):
+        self.on_match = on_match
+        self.repeatable_methods = repeatable_methods
+
+        self.currently_pressed_keys = list()
+        self.looking_for = {}
+        self.has_released_key = True
+
+    def load_bindings_from_file(self, file):
+        with open(file) as file:
+            for line in file:
+                method_and_keycodes = line.split('=')
+
+                method = method_and_keycodes[0]  # The method to run
+                rest_of_line = method_and_keycodes[1]  # Includes bindings we have to parse
+
+                # Allows inline comments in the bindings file
+                if '#' in rest_of_line:
+                    rest_of_line = rest_of_line[:rest_of_line.index('#')]
+
+                bindings = rest_of_line.rstrip()
+
+                if bindings != '':
+                    # Can have multiple bindings split by commas.
+                    for binding in bindings.split(','):
+                        keys = list()
+                        for single_key in binding.split('+'):
+                            keys.append(self.get_key_from_string(single_key))
+
+                        keys_tuple = tuple(keys)
+
+                        # looking_for is a dictionary where the keys are the bindings and the values
+                        # are all the methods linked to those keys, as you can have multiple bindings
+                        # per method and vice versa.
+
+                        if keys_tuple not in self.looking_for.keys():
+                            self.looking_for[keys_tuple] = []
+
+                        self.looking_for[keys_tuple].append(method)
+
+    def get_bound_methods(self):
+        return {method for methods in self.looking_for.values() for method in methods}
+
+    def on_press(self, key):
+        # Keys are unique in each binding, as it makes no sense to have ctrl+ctrl+f5, for example.
+        # Also prevents the same key being added more than once if held down too long, which happens
+        # on some systems.
+        if key not in self.currently_pressed_keys:
+            self.currently_pressed_keys.append(key)
+
+        methods = self.looking_for.get(tuple(self.currently_pressed_keys))
+
+        if methods is None:
+            return
+
+        # has_released_key avoids running the same methods for the same keyboard
+        # press - must release a key to run it again, unless the method is meant to
+        # repeat while held (e.g. volume_up).
+        if self.has_released_key:
+            for method in methods:
+                self.on_match(method)
+
+            self.has_released_key = False
+        else:
+            for method in methods:
+                # Ignores any account prefix, e.g. 'work:volume_up'
+                if method.rpartition(':')[2] in self.repeatable_methods:
+                    self.on_match(method)
+
+    def on_release(self, key):
+        self.has_released_key = True
+
+        # We ignore the key argument as dead/modified keys (e.g. shift+letter) can
+        # pollute the currently_pressed_keys list.
+        try:
+            self.currently_pressed_keys.pop()
+
+        except IndexError:  # Sometimes it's already empty so raises this exception, to be ignored.
+            pass
+
+    # Get pynput key from a string - modifier keys are captured in the try statement,
+    # while normal letter keys are obtained from the KeyCode.from_char() method.
+    @staticmethod
+    def get_key_from_string(key_str):
+        try:
+            return getattr(Key, key_str)
+
+        except AttributeError:
+            return KeyCode.from_char(key_str)
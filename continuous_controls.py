@@ -0,0 +1,89 @@
+# Volume and seek keys are usually held down, which repeats their presses many times a second.
+# Rather than a request per press, the changes are added up and sent at most once per interval.
+import logging
+import threading
+import time
+
+from exceptions import NotifiableError
+from notif_handler import send_notif
+
+
+class ControlAggregator:
+
+    # get_current() returns the current value and how fast it changes by itself per second (e.g.
+    # 1000 for the position in ms of a playing track), and is only used when our prediction
+    # is older than resync_after seconds. send(value) sets the value, and notify(value) shows it.
+    def __init__(self, get_current, send, notify, interval=0.25, minimum=0, get_maximum=lambda: None,
+                 resync_after=5):
+        self.get_current = get_current
+        self.send = send
+        self.notify = notify
+        self.interval = interval
+        self.minimum = minimum
+        self.get_maximum = get_maximum
+        self.resync_after = resync_after
+
+        self.value = None
+        self.rate = 0
+        self.known_at = 0
+        self.sent_value = None
+
+        self.condition = threading.Condition()
+        threading.Thread(target=self.flush_changes, daemon=True).start()
+
+    def predict(self, now):
+        return self.value + self.rate * (now - self.known_at)
+
+    def add(self, delta):
+        with self.condition:
+            is_stale = self.value is None or time.monotonic() - self.known_at > self.resync_after
+
+        # A request, which sending what's already been added shouldn't have to wait for.
+        current = self.get_current() if is_stale else None
+
+        with self.condition:
+            now = time.monotonic()
+
+            if current is not None:
+                self.value, self.rate = current
+                self.known_at = now
+                self.sent_value = None
+
+            value = self.predict(now) + delta
+            maximum = self.get_maximum()
+
+            self.value = max(self.minimum, value if maximum is None else min(maximum, value))
+            self.known_at = now
+
+            self.condition.notify()
+
+    # Sends the latest value as soon as it changes, but then waits an interval before sending
+    # again, so held keys cost one request per interval however fast they repeat.
+    def flush_changes(self):
+        while True:
+            with self.condition:
+                while self.value is None or self.value == self.sent_value:
+                    self.condition.wait()
+
+                value = round(self.predict(time.monotonic()))
+                self.sent_value = self.value
+
+            self.notify(value)
+
+            try:
+                self.send(value)
+            except Exception as e:
+                logging.warning('Could not send {}: {}'.format(value, repr(e)))
+
+                if isinstance(e, NotifiableError):
+                    send_notif(e.title, e.text)
+
+                # Whatever we predicted can't be trusted anymore.
+                with self.condition:
+                    self.value = self.sent_value = None
+
+            time.sleep(self.interval)
+
+    def reset(self):
+        with self.condition:
+            self.value = self.sent_value = None
@@ -0,0 +1,126 @@
+# Lets scripts, window managers and status bars control the running Spotify Helper through a
+# Unix domain socket, without starting a new Python process per command.
+#
+# The protocol is one command name per line; every command gets one JSON line back, in the same
+# order the commands were sent, so many commands can be pipelined over one connection.
+import json
+import logging
+import os
+import socketserver
+import stat
+import tempfile
+import threading
+from concurrent.futures import Future
+from queue import Queue
+
+# Answered straight away, which is handy to measure the round trip to the daemon.
+PING = 'ping'
+
+
+def get_socket_path(configured_path=''):
+    if configured_path:
+        return os.path.expanduser(configured_path)
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir())
+
+    return os.path.join(runtime_dir, 'spotify-helper-{}.sock'.format(os.getuid()))
+
+
+# Only ever removes a socket, not whatever else may have been put at path.
+def remove_socket(path):
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def is_supported():
+    return hasattr(socketserver, 'ThreadingUnixStreamServer')
+
+
+class ControlRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # Results are written by a separate thread, so we can keep reading (and queueing) commands
+        # while earlier ones are still running.
+        pending = Queue()
+        writer = threading.Thread(target=self.write_results, args=(pending,), daemon=True)
+        writer.start()
+
+        for line in self.rfile:
+            command = line.decode('utf-8').strip()
+
+            if command:
+                pending.put((command, self.server.dispatch(command)))
+
+        pending.put(None)
+        writer.join()
+
+    def write_results(self, pending):
+        while True:
+            item = pending.get()
+
+            if item is None:
+                return
+
+            command, future = item
+
+            try:
+                reply = {'command': command, 'ok': True, 'result': future.result()}
+            except Exception as e:
+                reply = {'command': command, 'ok': False, 'error': str(e) or type(e).__name__}
+
+            try:
+                self.wfile.write(json.dumps(reply, default=str).encode('utf-8') + b'\n')
+                self.wfile.flush()
+            except OSError:  # The client went away, but its commands still run.
+                pass
+
+
+class ControlServer:
+
+    # queue_method(method, future) schedules a command and resolves the future with its result,
+    # and is_command(method) says whether a command exists at all.
+    def __init__(self, socket_path, queue_method, is_command):
+        self.socket_path = socket_path
+        self.queue_method = queue_method
+        self.is_command = is_command
+        self.server = None
+
+    def dispatch(self, command):
+        future = Future()
+
+        if command == PING:
+            future.set_result('pong')
+        elif not self.is_command(command):
+            future.set_exception(ValueError('Unknown command: {}'.format(command)))
+        else:
+            self.queue_method(command, future)
+
+        return future
+
+    def start(self):
+        # A socket left behind by a previous run would stop us from binding.
+        remove_socket(self.socket_path)
+
+        # Only this user can connect, from the moment the socket exists.
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, ControlRequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.server.daemon_threads = True
+        self.server.dispatch = self.dispatch
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info('Control socket listening on {}'.format(self.socket_path))
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+            remove_socket(self.socket_path)
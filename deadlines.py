@@ -0,0 +1,131 @@
+# Gives every command a time budget that all of its requests share, and works out request
+# timeouts from how long each endpoint has actually been taking.
+import bisect
+import re
+import threading
+import time
+
+from exceptions import DeadlineExceededError
+
+current = threading.local()
+
+
+# Used as a context manager around a command; every request made on the same thread while it
+# is active gets at most the time that's left.
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = None
+        self.outer = None
+
+    def __enter__(self):
+        self.expires_at = time.monotonic() + self.budget
+        self.outer = getattr(current, 'deadline', None)
+        current.deadline = self
+
+        return self
+
+    def __exit__(self, *exc_info):
+        current.deadline = self.outer
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+
+def get_current_deadline():
+    return getattr(current, 'deadline', None)
+
+
+# Shrinks a timeout to what's left of the current deadline, if there is one.
+def get_timeout(timeout):
+    deadline = get_current_deadline()
+
+    if deadline is None:
+        return timeout
+
+    remaining = deadline.remaining()
+
+    if remaining <= 0:
+        raise DeadlineExceededError
+
+    return min(timeout, remaining)
+
+
+def has_time_for(seconds):
+    deadline = get_current_deadline()
+
+    return deadline is None or deadline.remaining() > seconds
+
+
+# Counts latencies into exponentially sized buckets, halving every count once there are more than
+# window observations so old network conditions gradually stop mattering.
+class LatencyHistogram:
+    bounds = [0.005 * 1.25 ** i for i in range(45)]  # 5ms up to ~115s
+
+    def __init__(self, window=500):
+        self.window = window
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+
+        if self.total > self.window:
+            self.counts = [count // 2 for count in self.counts]
+            self.total = sum(self.counts)
+
+    def percentile(self, fraction):
+        threshold = fraction * self.total
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= threshold:
+                return self.bounds[min(i, len(self.bounds) - 1)]
+
+        return self.bounds[-1]
+
+
+class EndpointLatencies:
+    # Ids and user names in endpoints are replaced, so e.g. every playlist shares one histogram.
+    id_pattern = re.compile(r'(?<=/)(users/[^/]+(?=/)|[0-9A-Za-z]{22}(?=/|$))')
+
+    # Until an endpoint has min_samples observations, default_timeout is used as is.
+    def __init__(self, factor=3, min_timeout=0.5, max_timeout=4, min_samples=20):
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(rest_function_name, path):
+        return rest_function_name + ' ' + EndpointLatencies.get_pattern(path)
+
+    # e.g. '/v1/playlists/37i9dQZF1DXcBWIGoYBM5M/tracks' becomes '/v1/playlists/{id}/tracks'.
+    @staticmethod
+    def get_pattern(path):
+        return EndpointLatencies.id_pattern.sub(
+            lambda match: 'users/{user}' if match.group(0).startswith('users/') else '{id}', path)
+
+    def observe(self, key, seconds):
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram()
+
+            self.histograms[key].observe(seconds)
+
+    def get_timeout(self, key, default_timeout):
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None or histogram.total < self.min_samples:
+                return default_timeout
+
+            p99 = histogram.percentile(0.99)
+
+        return max(self.min_timeout, min(self.max_timeout, p99 * self.factor))
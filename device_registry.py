@@ -0,0 +1,92 @@
+# Caches the user's Spotify devices so playback commands don't have to list them first.
+import platform
+import threading
+import time
+
+from web_api import open_shelf
+
+
+def get_device_name():
+    return platform.uname()[1]
+
+
+class DeviceRegistry:
+
+    # fetch_devices is called whenever the cached device list is missing or too old, and
+    # has to return the devices of the 'me/player/devices' endpoint as models.Device objects.
+    def __init__(self, fetch_devices, info_file, ttl=10):
+        self.fetch_devices = fetch_devices
+        self.info_file = info_file
+        self.ttl = ttl
+
+        self.devices = None
+        self.devices_fetched_at = 0
+
+        # 'me/player' responses include the active device, so we keep the last one we saw.
+        self.active_device = None
+        self.active_device_seen_at = 0
+
+        self.lock = threading.Lock()
+
+    def get_devices(self):
+        with self.lock:
+            if self.devices is None or time.time() - self.devices_fetched_at > self.ttl:
+                self.devices = self.fetch_devices() or []
+                self.devices_fetched_at = time.time()
+
+                active = next((device for device in self.devices if device.is_active), None)
+                self.active_device = active
+                self.active_device_seen_at = self.devices_fetched_at
+
+            return self.devices
+
+    # The active device is the one currently playing music, not necessarily the one currently
+    # being used by the user (for example, music could be playing through a phone, but the user
+    # is on their computer).
+    def get_active_device(self):
+        with self.lock:
+            if self.active_device is not None and time.time() - self.active_device_seen_at <= self.ttl:
+                return self.active_device
+
+        devices = self.get_devices()
+
+        return next((device for device in devices if device.is_active), None)
+
+    # This machine's device id doesn't change between sessions, so once found it is saved
+    # alongside the authentication info and transfers only need the transfer request itself.
+    def get_this_device_id(self):
+        with open_shelf(self.info_file) as shelf:
+            if 'device_id' in shelf:
+                return shelf['device_id']
+
+        device_id = next((device.id for device in self.get_devices()
+                          if device.name == get_device_name()), None)
+
+        if device_id is not None:
+            with open_shelf(self.info_file) as shelf:
+                shelf['device_id'] = device_id
+
+        return device_id
+
+    # Called with the Device of every successful 'me/player' response.
+    def observe_active_device(self, device):
+        if device is None:
+            return
+
+        with self.lock:
+            self.active_device = device
+            self.active_device_seen_at = time.time()
+
+            if self.devices is not None:
+                for cached_device in self.devices:
+                    cached_device.is_active = cached_device.id == device.id
+
+    # Called when Spotify tells us our idea of the devices is wrong (e.g. NO_ACTIVE_DEVICE).
+    def invalidate(self):
+        with self.lock:
+            self.devices = None
+            self.active_device = None
+
+        with open_shelf(self.info_file) as shelf:
+            if 'device_id' in shelf:
+                del shelf['device_id']
@@ -1,2 +1,18 @@
-class AlreadyNotifiedException(Exception):
-    pass
\ No newline at end of file
+# Raised for problems to tell the user about as they are (e.g. that there is no device to play
+# on), which are notified about, or sent back to commands from the control socket.
+class NotifiableError(Exception):
+    def __init__(self, title, text):
+        super().__init__('{}: {}'.format(title, text))
+        self.title = title
+        self.text = text
+
+
+# Raised when a command has used up its time budget (see deadlines.py).
+class DeadlineExceededError(ConnectionError):
+    pass
+
+
+# Raised when a request can't have reached the server (e.g. it couldn't connect, or the host's
+# circuit breaker is open), so doing the same thing another way can't do it twice.
+class RequestNotSentError(ConnectionError):
+    pass
@@ -0,0 +1,90 @@
+# Optionally runs the keyboard listener in a child process that only matches chords, so key
+# events are handled straight away however busy the main process (decoding responses, sending
+# requests and notifications) keeps the GIL. Matched methods are sent back as JSON lines on the
+# child's stdout.
+#
+# The child runs this file as a script, rather than through multiprocessing, whose 'spawn' would
+# import the app's main script (and everything it imports) again in the child.
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+from chord_matcher import ChordMatcher
+
+
+# The child process: nothing but pynput and the chord matcher are imported here.
+def listen(send, bindings_file, repeatable_methods):
+    from pynput import keyboard
+
+    matcher = ChordMatcher(send, repeatable_methods)
+    matcher.load_bindings_from_file(bindings_file)
+
+    with keyboard.Listener(on_press=matcher.on_press, on_release=matcher.on_release) as listener:
+        listener.join()
+
+
+class ListenerProcess:
+
+    # on_match(method) is called in this process for every method the child matches. target is
+    # what the child runs instead of listen(), as (file, function name, extra arguments).
+    def __init__(self, on_match, bindings_file, repeatable_methods, target=None):
+        self.on_match = on_match
+        self.bindings_file = bindings_file
+        self.repeatable_methods = repeatable_methods
+        self.target = target
+
+        self.process = None
+
+    def start(self):
+        options = {'bindings_file': self.bindings_file, 'repeatable_methods': list(self.repeatable_methods),
+                   'target': self.target}
+
+        # The child exits once its stdin closes, i.e. when this process does.
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), json.dumps(options)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        threading.Thread(target=self.receive, args=(self.process.stdout,), name='keyboard-listener',
+                         daemon=True).start()
+
+        return self
+
+    def receive(self, stdout):
+        for line in stdout:
+            self.on_match(json.loads(line))
+
+        logging.warning('Keyboard listener process exited')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def send_to_parent(match):
+    sys.stdout.write(json.dumps(match) + '\n')
+    sys.stdout.flush()
+
+
+def exit_with_parent():
+    sys.stdin.read()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    options = json.loads(sys.argv[1])
+    target, target_args = listen, ()
+
+    if options['target'] is not None:
+        target_file, target_name, target_args = options['target']
+        spec = importlib.util.spec_from_file_location('listener_target', target_file)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        target = getattr(module, target_name)
+
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+
+    target(send_to_parent, options['bindings_file'], options['repeatable_methods'], *target_args)
@@ -0,0 +1,122 @@
+# Lightweight models for the Web API payloads we use, so each response is decoded and
+# walked once instead of every reader calling response.json() and chaining .get()s.
+import json
+
+# orjson is noticeably faster at decoding, but isn't required.
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+# Decodes a requests.Response body only once, however many times it is asked for.
+def decode(response):
+    try:
+        return response.decoded_json
+    except AttributeError:
+        content = response.content
+        response.decoded_json = loads(content) if content else None
+
+        return response.decoded_json
+
+
+class Device:
+    __slots__ = ('id', 'name', 'type', 'is_active', 'volume_percent')
+
+    def __init__(self, id, name, type=None, is_active=False, volume_percent=None):
+        self.id = id
+        self.name = name
+        self.type = type
+        self.is_active = is_active
+        self.volume_percent = volume_percent
+
+    @staticmethod
+    def from_json(json):
+        if json is None:
+            return None
+
+        return Device(json.get('id'), json.get('name'), json.get('type'),
+                      bool(json.get('is_active')), json.get('volume_percent'))
+
+
+class Track:
+    __slots__ = ('id', 'name', 'artists', 'album', 'images', 'duration_ms')
+
+    # artists is a list of names, and images a list of urls ordered from highest to lowest quality.
+    def __init__(self, id, name, artists, album, images, duration_ms=None):
+        self.id = id
+        self.name = name
+        self.artists = artists
+        self.album = album
+        self.images = images
+        self.duration_ms = duration_ms
+
+    @staticmethod
+    def from_json(json):
+        if json is None:
+            return None
+
+        album = json.get('album') or {}
+
+        return Track(json.get('id'), json.get('name'),
+                     [artist.get('name') for artist in json.get('artists') or ()],
+                     album.get('name'),
+                     [image.get('url') for image in album.get('images') or ()],
+                     json.get('duration_ms'))
+
+    # We don't need very high quality images for notifications, so we get
+    # the images at the end of the list (which is ordered by quality).
+    def art_url(self, quality=2):
+        if not self.images:
+            return None
+
+        return self.images[-quality if len(self.images) >= 2 else 0]
+
+
+class PlaybackState:
+    __slots__ = ('is_playing', 'shuffle_state', 'repeat_state', 'progress_ms', 'context_uri', 'item', 'device')
+
+    def __init__(self, is_playing, shuffle_state, repeat_state, progress_ms, context_uri, item, device):
+        self.is_playing = is_playing
+        self.shuffle_state = shuffle_state
+        self.repeat_state = repeat_state
+        self.progress_ms = progress_ms
+        self.context_uri = context_uri
+        self.item = item
+        self.device = device
+
+    @staticmethod
+    def from_json(json):
+        context = json.get('context') or {}
+
+        return PlaybackState(json.get('is_playing'), json.get('shuffle_state'), json.get('repeat_state'),
+                             json.get('progress_ms'), context.get('uri'),
+                             Track.from_json(json.get('item')), Device.from_json(json.get('device')))
+
+
+class Paging:
+    __slots__ = ('items', 'limit', 'offset', 'total', 'next')
+
+    def __init__(self, items, limit, offset, total, next):
+        self.items = items
+        self.limit = limit
+        self.offset = offset
+        self.total = total
+        self.next = next
+
+    # item_from_json converts each of the page's items, which are otherwise left as they are.
+    @staticmethod
+    def from_json(json, item_from_json=None):
+        items = json.get('items') or []
+
+        if item_from_json is not None:
+            items = [item_from_json(item) for item in items]
+
+        return Paging(items, json.get('limit'), json.get('offset'), json.get('total'), json.get('next'))
+
+    # If a response contains a 'next', it means there are more results that we will then have to request.
+    @property
+    def has_next(self):
+        return self.next is not None
@@ -0,0 +1,55 @@
+# Finds (or creates) each month's playlist shortly before the month starts, so the first
+# toggle_save_monthly_playlist of the month doesn't have to search through every playlist.
+import datetime
+import logging
+import threading
+import time
+
+from deadlines import Deadline
+
+
+def get_next_month_start(now):
+    if now.month == 12:
+        return datetime.datetime(now.year + 1, 1, 1)
+
+    return datetime.datetime(now.year, now.month + 1, 1)
+
+
+class MonthlyPlaylistScheduler:
+
+    # get_monthly_playlist_id(when) has to resolve and save the playlist id of the month 'when' is in.
+    def __init__(self, get_monthly_playlist_id, lead_time=600, retry_interval=60, budget=30):
+        self.get_monthly_playlist_id = get_monthly_playlist_id
+        self.lead_time = lead_time
+        self.retry_interval = retry_interval
+        self.budget = budget
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def resolve(self, when):
+        while True:
+            try:
+                with Deadline(self.budget):
+                    return self.get_monthly_playlist_id(when)
+
+            except Exception as e:
+                logging.info('Could not resolve the playlist for {:%B %Y}, retrying: {}'.format(when, repr(e)))
+                time.sleep(self.retry_interval)
+
+    def run(self):
+        # This month's playlist may not be known yet either (e.g. on the first run).
+        self.resolve(datetime.datetime.now())
+
+        while True:
+            next_month_start = get_next_month_start(datetime.datetime.now())
+            wake_at = next_month_start - datetime.timedelta(seconds=self.lead_time)
+
+            # Sleeping in short steps keeps us on time if the computer was suspended meanwhile.
+            while datetime.datetime.now() < wake_at:
+                time.sleep(min(600, max(1.0, (wake_at - datetime.datetime.now()).total_seconds())))
+
+            self.resolve(next_month_start)
+
+            while datetime.datetime.now() < next_month_start:
+                time.sleep(min(600, max(1.0, (next_month_start - datetime.datetime.now()).total_seconds())))
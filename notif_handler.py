@@ -3,14 +3,26 @@
 import platform
 import os
 import tempfile
+import threading
 import time
+from collections import OrderedDict
 from urllib.request import urlopen
 from urllib.error import URLError
 
+import deadlines
+import tracing
+from exceptions import DeadlineExceededError
+
 current_os = platform.system()  # This method returns 'Darwin' for macs.
 
 notif_icon_path = os.path.join(os.path.dirname(__file__), 'resources/spo.png')
 
+# Recently downloaded album art, most recently used last, so art that was prefetched (or is shown
+# again) doesn't have to be downloaded again.
+image_cache = OrderedDict()
+image_cache_size = 16
+image_cache_lock = threading.Lock()
+
 if current_os == 'Linux':
     import subprocess
 
@@ -52,6 +64,11 @@ def linux_notify(title, text, icon_path, duration):
 
 
 def send_notif(title, text, icon_path=notif_icon_path, duration=3):
+    with tracing.span('notification', title=title):
+        notify(title, text, icon_path, duration)
+
+
+def notify(title, text, icon_path, duration):
     if current_os == 'Linux':
         linux_notify(title, text, icon_path, duration * 1000)
     elif current_os == 'Darwin':
@@ -60,25 +77,57 @@ def send_notif(title, text, icon_path=notif_icon_path, duration=3):
         windows_notify(title, text, icon_path, duration)
 
 
+def download_image(image_url, timeout):
+    with image_cache_lock:
+        if image_url in image_cache:
+            image_cache.move_to_end(image_url)
+            return image_cache[image_url]
+
+    with tracing.span('art download', url=image_url), \
+            urlopen(image_url, timeout=deadlines.get_timeout(timeout)) as response:
+        data = response.read()
+
+    with image_cache_lock:
+        image_cache[image_url] = data
+
+        while len(image_cache) > image_cache_size:
+            image_cache.popitem(last=False)
+
+    return data
+
+
+def prefetch_image(image_url, timeout=2):
+    if image_url is not None:
+        download_image(image_url, timeout)
+
+
 def send_notif_with_web_image(title, text, image_url, timeout=2):
-    # We have to temporarily write the image contents to a file to use it in notifications.
+    if image_url is None:
+        send_notif(title, text)
+        return
+
     try:
-        # Don't want to delay the notification too long
-        with urlopen(image_url, timeout=timeout) as response:
-            data = response.read()
+        # Don't want to delay the notification too long, nor go over the command's deadline
+        data = download_image(image_url, timeout)
 
-            file = tempfile.NamedTemporaryFile(delete=False)
-            file.write(data)
+    except (URLError, TimeoutError, DeadlineExceededError):
+        send_notif(title, text)
+        return
 
-            send_notif(title, text, file.name)
+    # We have to temporarily write the image contents to a file to use it in notifications.
+    file = tempfile.NamedTemporaryFile(delete=False)
 
-            # Without this the file gets deleted too quick or something and
-            # doesn't show up
-            time.sleep(0.1)
+    try:
+        file.write(data)
+        file.flush()
 
-            file.close()
+        send_notif(title, text, file.name)
 
-            os.unlink(file.name)
+        # Without this the file gets deleted too quick or something and
+        # doesn't show up
+        time.sleep(0.1)
 
-    except URLError:
-        send_notif(title, text)
+    finally:
+        file.close()
+
+        os.unlink(file.name)
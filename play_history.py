@@ -0,0 +1,308 @@
+# Remembers what was played, for commands about earlier tracks (e.g. save_previous_track), in a
+# compact append-only log: a fixed-size record per play, pointing at strings (track ids, contexts,
+# devices) kept once each in a file alongside. Plays are also kept in memory by column, in time
+# order, so queries are a bisect and a slice.
+import array
+import bisect
+import logging
+import os
+import struct
+import threading
+import time
+
+from deadlines import Deadline
+
+header = struct.Struct('<4sI')  # b'PLAY', and the generation of the strings file the plays use
+play_entry = struct.Struct('<IIII')  # played_at, and the track, context and device string indices
+
+
+class Play:
+    __slots__ = ('played_at', 'track_id', 'context_uri', 'device_id')
+
+    def __init__(self, played_at, track_id, context_uri, device_id):
+        self.played_at = played_at
+        self.track_id = track_id
+        self.context_uri = context_uri
+        self.device_id = device_id
+
+
+# Plays as slices of the history's columns, only made into Play objects when indexed, so queries
+# over many plays don't build one per play.
+class Plays:
+    __slots__ = ('times', 'tracks', 'contexts', 'devices', 'strings')
+
+    def __init__(self, times, tracks, contexts, devices, strings):
+        self.times = times
+        self.tracks = tracks
+        self.contexts = contexts
+        self.devices = devices
+        self.strings = strings  # Only ever added to, so the indices stay valid
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        return Play(self.times[i], self.strings[self.tracks[i]],
+                    self.strings[self.contexts[i]] or None, self.strings[self.devices[i]] or None)
+
+    def get_track_ids(self):
+        return [self.strings[track] for track in self.tracks]
+
+
+class PlayHistory:
+
+    # Plays older than retention_days are dropped when compacting.
+    def __init__(self, file, retention_days=730):
+        self.file = file
+        self.retention = retention_days * 24 * 60 * 60
+
+        self.times = array.array('I')
+        self.tracks = array.array('I')
+        self.contexts = array.array('I')
+        self.devices = array.array('I')
+
+        self.strings = []
+        self.string_indices = {}
+
+        # Compacting renumbers the strings, so writes them to a new file, whose generation is
+        # then saved with the plays that use it.
+        self.generation = 0
+
+        self.lock = threading.Lock()
+        self.log = None
+        self.strings_log = None
+
+        self.load()
+        self.compact_if_needed()
+        self.open_logs()
+
+    def get_strings_file(self, generation):
+        return '{}-strings-{}'.format(self.file, generation)
+
+    def open_logs(self):
+        if not os.path.exists(self.file):
+            with open(self.file, 'wb') as file:
+                file.write(header.pack(b'PLAY', self.generation))
+
+        self.log = open(self.file, 'ab')
+        self.strings_log = open(self.get_strings_file(self.generation), 'ab')
+
+    def load(self):
+        try:
+            with open(self.file, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+
+        # Not even the header was written, so it gets started again.
+        if len(data) < header.size:
+            os.remove(self.file)
+            return
+
+        self.generation = header.unpack_from(data)[1]
+
+        try:
+            with open(self.get_strings_file(self.generation), 'rb') as file:
+                strings = file.read().split(b'\n')
+        except FileNotFoundError:
+            strings = [b'']
+
+        # Anything after the last newline was cut short, e.g. by a crash.
+        for string in strings[:-1]:
+            self.add_string(string.decode())
+
+        plays = array.array('I')
+        plays.frombytes(data[header.size:header.size + (len(data) - header.size) // play_entry.size * play_entry.size])
+
+        self.times, self.tracks, self.contexts, self.devices = (plays[i::4] for i in range(4))
+
+        # Strings are written before the plays that use them, so if a crash lost some strings, the
+        # plays from the first one using them on can't be trusted.
+        valid = len(self.times)
+        if max(max(column, default=0) for column in (self.tracks, self.contexts, self.devices)) >= len(self.strings):
+            valid = next(i for i in range(len(self.times))
+                         if max(self.tracks[i], self.contexts[i], self.devices[i]) >= len(self.strings))
+
+        valid_size = header.size + valid * play_entry.size
+        if valid_size < len(data) or len(strings[-1]) > 0:
+            logging.warning('Dropping what was cut short at the end of {}'.format(self.file))
+
+            for column in (self.times, self.tracks, self.contexts, self.devices):
+                del column[valid:]
+
+            with open(self.file, 'r+b') as file:
+                file.truncate(valid_size)
+
+            with open(self.get_strings_file(self.generation), 'wb') as file:
+                file.write(b''.join(string.encode() + b'\n' for string in self.strings))
+
+    def add_string(self, string):
+        self.string_indices[string] = len(self.strings)
+        self.strings.append(string)
+
+    def add_play(self, played_at, track, context, device):
+        self.times.append(played_at)
+        self.tracks.append(track)
+        self.contexts.append(context)
+        self.devices.append(device)
+
+    # Strings are written before the plays that use them.
+    def get_string_index(self, string):
+        index = self.string_indices.get(string)
+
+        if index is None:
+            self.strings_log.write(string.encode() + b'\n')
+            self.strings_log.flush()
+            self.add_string(string)
+            index = len(self.strings) - 1
+
+        return index
+
+    # Called whenever playback is seen, which can be many times per track, but only records a
+    # play when the track changes.
+    def observe(self, track_id, context_uri=None, device_id=None, played_at=None):
+        # e.g. local files, which have no id.
+        if track_id is None:
+            return
+
+        with self.lock:
+            if self.tracks and self.strings[self.tracks[-1]] == track_id:
+                return
+
+            self.record(track_id, context_uri, device_id, played_at)
+
+    def record(self, track_id, context_uri, device_id, played_at):
+        played_at = int(played_at or time.time())
+
+        # Times only go forwards, so they stay sorted even if the clock doesn't.
+        if self.times:
+            played_at = max(played_at, self.times[-1])
+
+        track, context, device = (self.get_string_index(string or '') for string in (track_id, context_uri, device_id))
+
+        self.log.write(play_entry.pack(played_at, track, context, device))
+        self.log.flush()
+
+        self.add_play(played_at, track, context, device)
+
+    def get_play(self, i):
+        return Play(self.times[i], self.strings[self.tracks[i]],
+                    self.strings[self.contexts[i]] or None, self.strings[self.devices[i]] or None)
+
+    # The last n plays, most recent first.
+    def get_last(self, n):
+        with self.lock:
+            return [self.get_play(i) for i in range(len(self.times) - 1, max(-1, len(self.times) - 1 - n), -1)]
+
+    # Plays from start until end (unix times), oldest first.
+    def get_between(self, start, end=None):
+        with self.lock:
+            first = bisect.bisect_left(self.times, int(start))
+            last = len(self.times) if end is None else bisect.bisect_left(self.times, int(end))
+
+            return Plays(self.times[first:last], self.tracks[first:last], self.contexts[first:last],
+                         self.devices[first:last], self.strings)
+
+    # Plays, most recent first, back to the last play of the count-th different track.
+    def get_recent_plays(self, count):
+        plays = []
+        seen = set()
+
+        with self.lock:
+            for i in range(len(self.tracks) - 1, -1, -1):
+                if self.tracks[i] not in seen:
+                    if len(seen) == count:
+                        break
+
+                    seen.add(self.tracks[i])
+
+                plays.append(self.get_play(i))
+
+        return plays
+
+    # Compacting rewrites the whole log, so it only happens once there's a month's worth of
+    # plays past the retention period.
+    def compact_if_needed(self):
+        with self.lock:
+            if not self.times or self.times[0] >= time.time() - self.retention - 30 * 24 * 60 * 60:
+                return
+
+        self.compact()
+
+    # Drops plays older than the retention period and the strings nothing uses anymore, and
+    # replaces the log with one written from scratch.
+    def compact(self):
+        with self.lock:
+            first = bisect.bisect_left(self.times, int(time.time() - self.retention))
+            kept = [column[first:] for column in (self.tracks, self.contexts, self.devices)]
+
+            used = sorted(set(kept[0]) | set(kept[1]) | set(kept[2]))
+            new_indices = {old: new for new, old in enumerate(used)}
+            strings = [self.strings[old] for old in used]
+
+            columns = [self.times[first:]] + [array.array('I', (new_indices[index] for index in column))
+                                              for column in kept]
+
+            generation = self.generation + 1
+
+            with open(self.get_strings_file(generation), 'wb') as file:
+                file.write(b''.join(string.encode() + b'\n' for string in strings))
+
+            plays = array.array('I', bytes(len(columns[0]) * play_entry.size))
+            for i, column in enumerate(columns):
+                plays[i::4] = column
+
+            temporary_file = self.file + '.compacting'
+            with open(temporary_file, 'wb') as file:
+                file.write(header.pack(b'PLAY', generation))
+                file.write(plays.tobytes())
+
+            if self.log is not None:
+                self.log.close()
+                self.strings_log.close()
+
+            # Until this, the old plays and strings are still there to be loaded.
+            os.replace(temporary_file, self.file)
+            os.remove(self.get_strings_file(self.generation))
+
+            logging.info('Compacted {}: {} plays dropped'.format(self.file, first))
+
+            self.times, self.tracks, self.contexts, self.devices = columns
+            self.strings = []
+            self.string_indices = {}
+            for string in strings:
+                self.add_string(string)
+            self.generation = generation
+
+            if self.log is not None:
+                self.open_logs()
+
+
+class HistoryRecorder:
+
+    # poll() asks Spotify for the playback state, which ends up observed by the history like
+    # any other (see Spotify.observe_playback). The history is also compacted (if needed) daily.
+    def __init__(self, history, poll, interval=30, budget=10):
+        self.history = history
+        self.poll = poll
+        self.interval = interval
+        self.budget = budget
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        compacted_at = time.monotonic()
+
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                with Deadline(self.budget):
+                    self.poll()
+            except Exception as e:
+                logging.debug('Could not poll playback: {}'.format(repr(e)))
+
+            if time.monotonic() - compacted_at > 24 * 60 * 60:
+                self.history.compact_if_needed()
+                compacted_at = time.monotonic()
@@ -0,0 +1,180 @@
+# After a skip, the next command is very often about the new track (show_current_song, toggle_save,
+# toggle_save_monthly_playlist), so we fetch what those need in the background beforehand.
+import logging
+import threading
+import time
+
+import deadlines
+from notif_handler import prefetch_image
+
+
+class TtlCache:
+    # With max_size, the oldest values are dropped to make room for new ones.
+    def __init__(self, ttl, max_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires_at = self.values.get(key, (None, 0))
+
+            if time.monotonic() > expires_at:
+                self.values.pop(key, None)
+                return None
+
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.values.pop(key, None)
+            self.values[key] = (value, time.monotonic() + self.ttl)
+
+            if self.max_size is not None and len(self.values) > self.max_size:
+                del self.values[next(iter(self.values))]
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Prefetcher:
+
+    # delay gives Spotify time to actually change track before we ask about it, and also means
+    # rapid skipping only prefetches for the track that is finally landed on.
+    def __init__(self, spotify, delay=0.5, ttl=5, budget=5, max_cached=None):
+        self.spotify = spotify
+        self.delay = delay
+        self.budget = budget
+        self.cache = TtlCache(ttl, max_cached)
+
+        # Every schedule() cancels the prefetches before it.
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.last_track_id = None
+
+        # Prefetches run one at a time on a thread that stops when there's nothing left to do,
+        # so skipping through tracks quickly doesn't start a thread per skip.
+        self.scheduled = None
+        self.running = False
+
+        # When we last changed each key ourselves, so what a prefetch fetched before then (e.g.
+        # that a track isn't saved, just as toggle_save saves it) doesn't overwrite it.
+        self.changed_at = {}
+
+    def schedule(self, playback=None):
+        with self.lock:
+            self.generation += 1
+            self.scheduled = (self.generation, playback, time.monotonic())
+
+            start = not self.running
+            self.running = True
+
+        self.cache.clear()
+
+        if start:
+            threading.Thread(target=self.run_scheduled, name='prefetch', daemon=True).start()
+
+    def run_scheduled(self):
+        while True:
+            with self.lock:
+                if self.scheduled is None:
+                    self.running = False
+                    return
+
+                generation, playback, scheduled_at = self.scheduled
+                self.scheduled = None
+
+            self.prefetch(generation, playback, scheduled_at)
+
+    def is_cancelled(self, generation):
+        return generation != self.generation
+
+    # Called with every playback state the Web API gives us, to notice tracks changing by
+    # themselves (or from another device).
+    def observe_playback(self, playback):
+        track_id = playback.item.id if playback.item is not None else None
+
+        if track_id is not None and track_id != self.last_track_id:
+            self.last_track_id = track_id
+            self.schedule(playback)
+
+    def prefetch(self, generation, playback, scheduled_at):
+        if playback is None:
+            time.sleep(max(0, scheduled_at + self.delay - time.monotonic()))
+
+        try:
+            with deadlines.Deadline(self.budget):
+                if self.is_cancelled(generation):
+                    return
+
+                # If this shows a new track, observe_playback() starts another prefetch with it
+                # and cancels this one.
+                if playback is None:
+                    playback = self.spotify.get_playback_state()
+
+                if self.is_cancelled(generation) or playback.item is None:
+                    return
+
+                self.cache.set('playback', playback)
+                track = playback.item
+
+                steps = [
+                    lambda: self.set_fetched(('saved', track.id), lambda: self.spotify.fetch_is_saved(track.id)),
+                    lambda: prefetch_image(track.art_url()),
+                ]
+
+                # Finding the playlist could create it, and going through it costs a request per
+                # page, so only for those who use it.
+                if self.spotify.uses_monthly_playlist():
+                    def fetch_is_in_monthly_playlist():
+                        return self.spotify.fetch_is_in_monthly_playlist(track.id, 0)
+
+                    steps.insert(1, lambda: self.set_fetched(('in_monthly_playlist', track.id),
+                                                             fetch_is_in_monthly_playlist))
+
+                for step in steps:
+                    if self.is_cancelled(generation):
+                        return
+
+                    step()
+
+        except Exception as e:
+            # Commands will just fetch what they need themselves.
+            logging.info('Prefetch failed: {}'.format(repr(e)))
+
+    def set_fetched(self, key, fetch):
+        started_at = time.monotonic()
+        value = fetch()
+
+        with self.lock:
+            if self.changed_at.get(key, 0) < started_at:
+                self.cache.set(key, value)
+
+    def get_playback(self):
+        return self.cache.get('playback')
+
+    def get_is_saved(self, track_id):
+        return self.cache.get(('saved', track_id))
+
+    def get_is_in_monthly_playlist(self, track_id):
+        return self.cache.get(('in_monthly_playlist', track_id))
+
+    # Keeps the cache right after we change things ourselves.
+    def set_is_saved(self, track_id, is_saved):
+        self.set_changed(('saved', track_id), is_saved)
+
+    def set_is_in_monthly_playlist(self, track_id, is_in_playlist):
+        self.set_changed(('in_monthly_playlist', track_id), is_in_playlist)
+
+    def set_changed(self, key, value):
+        now = time.monotonic()
+
+        with self.lock:
+            # Prefetches can't take longer than their budget, so older changes no longer matter.
+            self.changed_at = {changed_key: changed_at for changed_key, changed_at in self.changed_at.items()
+                               if changed_at > now - self.budget}
+            self.changed_at[key] = now
+
+            self.cache.set(key, value)
@@ -0,0 +1,111 @@
+# A sampling profiler that can be started and stopped while the app runs (from the tray, or
+# with SIGUSR2), to see what a slow or busy app is doing. Every thread's stack is sampled
+# each interval and written out as collapsed stacks ('thread;outer;...;inner count' lines),
+# which flamegraph.pl and speedscope.app can show. Nothing runs while it's stopped.
+import datetime
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+
+    def __init__(self, directory, interval=0.005):
+        self.directory = directory
+        self.interval = interval
+
+        self.samples = Counter()
+        self.labels = {}
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def is_running(self):
+        return self.thread is not None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+
+            self.samples = Counter()
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+            self.thread.start()
+
+        logging.info('Profiling started')
+
+    # Returns the file the profile was written to.
+    def stop(self):
+        with self.lock:
+            if self.thread is None:
+                return None
+
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+        return self.dump()
+
+    def get_label(self, code):
+        label = self.labels.get(code)
+
+        if label is None:
+            label = '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+            self.labels[code] = label
+
+        return label
+
+    def run(self):
+        own_id = threading.get_ident()
+        cpu_times = {}
+
+        while not self.stopping.wait(self.interval):
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(self.get_label(frame.f_code))
+                    frame = frame.f_back
+
+                thread = threads.get(thread_id)
+                stack.append(thread.name if thread is not None else str(thread_id))
+                stack.reverse()
+
+                # Where we can tell, threads that used no CPU since the last sample are marked as
+                # waiting, e.g. on a queue, a lock or the network.
+                cpu_time = get_thread_cpu_time(thread) if thread is not None else None
+                if cpu_time is not None:
+                    if cpu_time == cpu_times.get(thread_id):
+                        stack.append('[waiting]')
+                    cpu_times[thread_id] = cpu_time
+
+                self.samples[';'.join(stack)] += 1
+
+    def dump(self):
+        file = os.path.join(self.directory, 'spotify-helper-profile-{:%Y%m%d-%H%M%S}.txt'.format(datetime.datetime.now()))
+
+        with open(file, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+        logging.info('Profiling stopped, {} samples saved to {}'.format(sum(self.samples.values()), file))
+
+        return file
+
+
+# Only Linux lets us read other threads' CPU time, in nanoseconds. Read from /proc rather than
+# with time.pthread_getcpuclockid(), which can crash if the thread has just finished.
+def get_thread_cpu_time(thread):
+    try:
+        with open('/proc/self/task/{}/schedstat'.format(thread.native_id)) as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,143 @@
+# Retrying and circuit breaking for requests to the Web API and the token relay.
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from exceptions import RequestNotSentError
+
+
+class RetryPolicy:
+    # Responses worth trying again, as the server may well answer the next time.
+    retry_statuses = (500, 502, 503, 504)
+
+    def __init__(self, attempts=3, base_delay=0.25, max_delay=2.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    # Exponential backoff with 'full jitter', so clients that failed together don't
+    # all retry at the same moment.
+    def delays(self):
+        for attempt in range(self.attempts - 1):
+            yield random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    # Whether exception means the request never got to the server: connecting timed out, or no
+    # connection could be made at all (e.g. it was refused, or the host name didn't resolve, as
+    # urllib3's NameResolutionError is a NewConnectionError). Anything else, like the connection
+    # being reset, may have happened after the request was sent.
+    @staticmethod
+    def was_not_sent(exception):
+        if isinstance(exception, requests.exceptions.ConnectTimeout):
+            return True
+
+        if not isinstance(exception, requests.exceptions.ConnectionError) or not exception.args:
+            return False
+
+        # requests wraps urllib3's MaxRetryError, whose reason is what actually went wrong.
+        reason = getattr(exception.args[0], 'reason', exception.args[0])
+
+        return isinstance(reason, NewConnectionError)
+
+    # Requests that aren't idempotent (e.g. POST me/player/next, which would skip twice) are
+    # only retried if they could not have reached the server.
+    @staticmethod
+    def can_retry_exception(exception, idempotent):
+        if RetryPolicy.was_not_sent(exception):
+            return True
+
+        return idempotent and isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    # Returns how long to wait before retrying the response, or None if it shouldn't be retried.
+    def get_retry_delay(self, response, idempotent, delays):
+        if response.status_code == 429:
+            # Rate limited: the request wasn't run, so it is safe to retry whatever it is, as
+            # long as Spotify doesn't want us to wait longer than we would anyway.
+            try:
+                retry_after = float(response.headers.get('Retry-After', self.base_delay))
+            except ValueError:
+                return None
+
+            return retry_after if retry_after <= self.max_delay and next(delays, None) is not None else None
+
+        if idempotent and response.status_code in self.retry_statuses:
+            return next(delays, None)
+
+        return None
+
+
+class CircuitBreaker:
+
+    # After failure_threshold consecutive failures, requests fail immediately instead of
+    # waiting for their own timeouts, and the host is probed every probe_interval seconds
+    # in the background until it answers again.
+    def __init__(self, url, failure_threshold=5, probe_interval=5, probe_timeout=2):
+        url_parts = urlsplit(url)
+        self.probe_url = '{}://{}/'.format(url_parts.scheme, url_parts.netloc)
+
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+
+        self.consecutive_failures = 0
+        self.is_open = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.is_open:
+            raise RequestNotSentError('{} is unreachable'.format(self.probe_url))
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+
+            if self.is_open or self.consecutive_failures < self.failure_threshold:
+                return
+
+            self.is_open = True
+
+        logging.warning('{} failed {} times in a row, failing fast until it is reachable again'.format(
+            self.probe_url, self.consecutive_failures))
+        threading.Thread(target=self.probe_until_reachable, daemon=True).start()
+
+    def probe_until_reachable(self):
+        while True:
+            time.sleep(self.probe_interval)
+
+            try:
+                # Any answer that isn't a server error means the host is usable again.
+                if requests.head(self.probe_url, timeout=self.probe_timeout).status_code >= 500:
+                    continue
+            except requests.exceptions.RequestException:
+                continue
+
+            with self.lock:
+                self.is_open = False
+                self.consecutive_failures = 0
+
+            logging.info('{} is reachable again'.format(self.probe_url))
+            return
+
+
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
+
+
+# Breakers are shared by host, as every account talks to the same servers.
+def get_circuit_breaker(url, **kwargs):
+    url_parts = urlsplit(url)
+    host = (url_parts.scheme, url_parts.netloc)
+
+    with circuit_breakers_lock:
+        if host not in circuit_breakers:
+            circuit_breakers[host] = CircuitBreaker(url, **kwargs)
+
+        return circuit_breakers[host]
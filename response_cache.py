@@ -0,0 +1,195 @@
+# Keeps the bodies of rarely-changing Web API resources (e.g. 'me', 'me/playlists') on disk with
+# their ETags, so they're asked for again with If-None-Match, and a 304 costs neither the body
+# nor decoding it. Within an endpoint's ttl, they aren't asked for at all.
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from deadlines import EndpointLatencies
+
+# Where the times entries were last revalidated are saved, so a 304 doesn't rewrite the body.
+revalidated_key = '\0revalidated'
+
+
+class CacheEntry:
+    __slots__ = ('etag', 'content', 'content_type', 'validated_at')
+
+    def __init__(self, etag, content, content_type, validated_at):
+        self.etag = etag
+        self.content = content
+        self.content_type = content_type
+        self.validated_at = validated_at
+
+
+class ResponseCache:
+
+    # ttls maps endpoint patterns (with ids replaced, e.g. 'playlists/{id}/tracks') to how many
+    # seconds a response is used without asking, after which it is revalidated with its ETag.
+    # Endpoints without a ttl aren't cached. Bodies are evicted, least recently used first,
+    # to keep them under max_bytes.
+    def __init__(self, file, ttls, max_bytes=5000000):
+        self.file = file
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+
+        self.shelf = None
+        # key: [etag, validated_at, size], least recently used first. Bodies are only read from
+        # the shelf when there isn't already a response for them.
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.revalidated = {}  # key: validated_at, for those revalidated since they were stored
+
+        # Responses already built for each key, so their bodies are only decoded once (see models.decode).
+        self.responses = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def get_pattern(endpoint):
+        return EndpointLatencies.get_pattern('/' + endpoint)[1:]
+
+    @staticmethod
+    def get_key(endpoint, params=None):
+        return endpoint + '?' + urlencode(sorted((key, str(value)) for key, value in (params or {}).items()))
+
+    # send(headers) sends the request with those extra headers, and returns its response.
+    def get(self, endpoint, params, send):
+        ttl = self.ttls.get(self.get_pattern(endpoint))
+
+        if ttl is None:
+            return send({})
+
+        key = self.get_key(endpoint, params)
+        etag, validated_at = self.lookup(key)
+
+        if validated_at is not None and time.time() - validated_at < ttl:
+            cached_response = self.get_response(key)
+
+            if cached_response is not None:
+                return cached_response
+
+        response = send({'If-None-Match': etag} if etag else {})
+
+        if response.status_code == 304:
+            cached_response = self.get_response(key, revalidated=True)
+
+            # It was invalidated in the meantime, so we need the body after all.
+            return cached_response if cached_response is not None else send({})
+
+        if response.status_code == 200:
+            self.store(key, CacheEntry(response.headers.get('ETag'), response.content,
+                                       response.headers.get('Content-Type'), time.time()), response)
+
+        return response
+
+    # Loads what's already on disk the first time the cache is used.
+    def open(self):
+        if self.shelf is not None:
+            return
+
+        self.shelf = shelve.open(self.file)
+        revalidated = self.shelf.get(revalidated_key, {})
+
+        entries = [(key, self.shelf[key]) for key in self.shelf if key != revalidated_key]
+        for key, entry in entries:
+            entry.validated_at = max(entry.validated_at, revalidated.get(key, 0))
+
+        for key, entry in sorted(entries, key=lambda item: item[1].validated_at):
+            self.index[key] = [entry.etag, entry.validated_at, len(entry.content)]
+            self.total_bytes += len(entry.content)
+
+        self.revalidated = {key: validated_at for key, validated_at in revalidated.items() if key in self.index}
+
+    # Returns the cached etag and when it was last validated, or Nones if key isn't cached.
+    def lookup(self, key):
+        with self.lock:
+            self.open()
+
+            if key not in self.index:
+                return None, None
+
+            self.index.move_to_end(key)
+            etag, validated_at, size = self.index[key]
+
+            return etag, validated_at
+
+    # response is the one entry was made from, so it can be returned as it is later.
+    def store(self, key, entry, response):
+        size = len(entry.content)
+
+        with self.lock:
+            self.open()
+            self.remove(key)
+
+            if size > self.max_bytes:
+                return
+
+            while self.total_bytes + size > self.max_bytes:
+                self.remove(next(iter(self.index)))
+
+            self.shelf[key] = entry
+            self.index[key] = [entry.etag, entry.validated_at, size]
+            self.total_bytes += size
+            self.responses[key] = response
+
+            if self.revalidated.pop(key, None) is not None:
+                self.shelf[revalidated_key] = self.revalidated
+
+    def remove(self, key):
+        if key in self.index:
+            self.total_bytes -= self.index.pop(key)[2]
+            del self.shelf[key]
+
+        self.responses.pop(key, None)
+
+    # Returns None if key isn't cached (anymore).
+    def get_response(self, key, revalidated=False):
+        with self.lock:
+            if key not in self.index:
+                return None
+
+            if revalidated:
+                self.index[key][1] = self.revalidated[key] = time.time()
+                self.shelf[revalidated_key] = self.revalidated
+
+            response = self.responses.get(key)
+
+            if response is None:
+                entry = self.shelf[key]
+
+                response = requests.Response()
+                response.status_code = 200
+                response._content = entry.content
+                response.headers = CaseInsensitiveDict({'Content-Type': entry.content_type, 'ETag': entry.etag})
+                response.encoding = 'utf-8'
+
+                self.responses[key] = response
+
+            return response
+
+    # Called after changing endpoint, dropping anything cached under it, e.g. POST
+    # 'users/{user}/playlists/{id}/tracks' drops every page of 'playlists/{id}/tracks'.
+    # 'users/{user}/...' are taken to be ours, so creating a playlist with POST
+    # 'users/{user}/playlists' also drops 'me/playlists'.
+    def invalidate(self, endpoint):
+        paths = [endpoint]
+        if endpoint.startswith('users/') and endpoint.count('/') >= 2:
+            path = endpoint.split('/', 2)[2]
+            paths.append('me/' + path)
+
+            # Only a particular playlist's, not every 'playlists/...'.
+            if '/' in path:
+                paths.append(path)
+
+        with self.lock:
+            self.open()
+
+            for key in list(self.index):
+                cached_path = key.partition('?')[0]
+
+                if any(cached_path == path or cached_path.startswith(path + '/') for path in paths):
+                    self.remove(key)
@@ -0,0 +1,73 @@
+# Lets concurrent identical requests share a single one that's already in flight, as commands
+# running on different queues often ask for the same thing (e.g. 'me/player') at the same time.
+import threading
+
+import deadlines
+from exceptions import DeadlineExceededError
+
+
+class Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    # Runs function(), unless a call with the same key is already running, in which case its
+    # result (or exception) is shared instead. Nothing is kept once the call has finished.
+    def do(self, key, function):
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                is_leader = call is None
+
+                if is_leader:
+                    call = Call()
+                    self.calls[key] = call
+
+            if is_leader:
+                break
+
+            # Still only wait for as long as our own deadline allows.
+            deadline = deadlines.get_current_deadline()
+
+            if not call.done.wait(None if deadline is None else max(0, deadline.remaining())):
+                raise DeadlineExceededError
+
+            # The leader running out of its own (maybe shorter) time says nothing about ours, so
+            # we try again, leading the next call if nobody else is.
+            if isinstance(call.error, DeadlineExceededError):
+                continue
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = function()
+
+            return call.result
+
+        except Exception as e:
+            call.error = e
+            raise
+
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+            call.done.set()
+
+
+# Params can hold lists (e.g. ids), so they're turned into something hashable.
+def make_key(*parts, params=None):
+    return parts + tuple(sorted((key, str(value)) for key, value in (params or {}).items()))
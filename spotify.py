@@ -2,12 +2,22 @@ import datetime
 import logging
 import os
 import platform
-import shelve
+import threading
+import time
 import configparser
 
 from notif_handler import send_notif, send_notif_with_web_image
-from web_api import WebApi
-from exceptions import AlreadyNotifiedException
+from web_api import WebApi, get_info_file, open_shelf
+from device_registry import DeviceRegistry
+import tracing
+from models import decode, Device, Paging, PlaybackState, Track
+from continuous_controls import ControlAggregator
+from monthly_playlist import MonthlyPlaylistScheduler
+from play_history import HistoryRecorder, PlayHistory
+from prefetch import Prefetcher
+from backend_router import BackendRouter
+from write_batcher import WriteBatcher
+from exceptions import NotifiableError, RequestNotSentError
 
 current_os = platform.system()
 
@@ -21,39 +31,141 @@ config = configparser.ConfigParser()
 config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
 
 
-def get_device_name():
-    return platform.uname()[1]
+# Methods whose local and Web API versions do the same thing, so either can be used. Others (e.g.
+# toggle_repeat, which AppleScript can only turn on and off) always try the local API first.
+routed_methods = {'get_current_track', 'get_track_id', 'next', 'previous'}
+
+# Commands that create this month's playlist if it doesn't exist yet.
+monthly_playlist_methods = {'toggle_save_monthly_playlist', 'add_recent_to_monthly_playlist'}
 
 
 class Spotify:
-    def __init__(self):
+    # account is None for the default account, or the name of one of the accounts in config.ini.
+    def __init__(self, account=None):
 
         client_id = config['authentication']['client_id']
 
-        redirect_uri = 'https://platelminto.eu.pythonanywhere.com/users/registering'
-
         scope_list = ['user-library-read', 'user-library-modify', 'playlist-modify-public',
                       'user-modify-playback-state', 'user-read-playback-state', 'playlist-modify-private']
 
         self.web_api = WebApi(scope_list=scope_list, client_id=client_id,
-                              redirect_uri=redirect_uri)
+                              account=account)
+        self.devices = DeviceRegistry(self.get_available_devices, self.web_api.info_file,
+                                      ttl=config.getfloat('devices', 'ttl'))
+
         if current_os == 'Darwin':
             self.local_api = AppleScriptApi()
 
         elif current_os == 'Windows':
             self.local_api = MediaKeysApi()
 
+        self.backend_router = None
+        if config.getboolean('backend_routing', 'enabled'):
+            self.backend_router = BackendRouter(smoothing=config.getfloat('backend_routing', 'smoothing'),
+                                                exploration=config.getfloat('backend_routing', 'exploration'),
+                                                max_failure_rate=config.getfloat('backend_routing',
+                                                                                 'max_failure_rate'))
+
+        self.prefetcher = None
+        if config.getboolean('prefetch', 'enabled'):
+            self.prefetcher = Prefetcher(self, delay=config.getfloat('prefetch', 'delay'),
+                                         ttl=config.getfloat('prefetch', 'ttl'),
+                                         max_cached=config.getint('resources', 'cache_entries')
+                                         if config.getboolean('resources', 'bounded') else None)
+
+        self.history = None
+        if config.getboolean('play_history', 'enabled'):
+            self.history = PlayHistory(get_info_file(account, '.history'),
+                                       retention_days=config.getint('play_history', 'retention_days'))
+
+            if config.getfloat('play_history', 'poll_interval') > 0:
+                HistoryRecorder(self.history, self.poll_playback,
+                                interval=config.getfloat('play_history', 'poll_interval')).start()
+
+        self.write_batcher = None
+        if config.getboolean('write_batching', 'enabled'):
+            self.write_batcher = WriteBatcher(self.send_batched_changes,
+                                              window=config.getfloat('write_batching', 'window'),
+                                              budget=config.getfloat('deadlines', 'command_budget'))
+
+        self.monthly_playlist_lock = threading.Lock()
+        self.monthly_playlist_used = False
+        self.monthly_playlist_scheduler = None
+        if self.uses_monthly_playlist():
+            self.use_monthly_playlist()
+
+        # Holding volume or seek keys down sends one request per interval, with the net change.
+        interval = config.getfloat('continuous_controls', 'interval')
+        self.volume = ControlAggregator(self.get_volume, self.set_volume,
+                                        lambda volume: send_notif('Volume', '{}%'.format(volume)),
+                                        interval=interval, get_maximum=lambda: 100)
+        self.track_duration_ms = None
+        self.position = ControlAggregator(self.get_position, self.seek,
+                                          lambda position: send_notif('Position', Spotify.format_time(position)),
+                                          interval=interval, get_maximum=lambda: self.track_duration_ms)
+
         self.repeat_states = ['track', 'context', 'off']
 
     def next(self):
         self.try_local_method_then_web('next', 'me/player/next', 'post')
+        self.position.reset()
+        self.prefetch()
 
     def previous(self):
         self.try_local_method_then_web('previous', 'me/player/previous', 'post')
+        self.position.reset()
+        self.prefetch()
+
+    # Gets ready for commands about the new track after a skip.
+    def prefetch(self):
+        if self.prefetcher is not None:
+            self.prefetcher.schedule()
 
     # Starting a song over means setting its current playing-time to 0.
     def restart(self):
         self.try_local_method_then_web('restart', 'me/player/seek', 'put', params={'position_ms': 0})
+        self.position.reset()
+
+    def volume_up(self):
+        self.volume.add(config.getint('continuous_controls', 'volume_step'))
+
+    def volume_down(self):
+        self.volume.add(-config.getint('continuous_controls', 'volume_step'))
+
+    def seek_forward(self):
+        self.position.add(config.getfloat('continuous_controls', 'seek_step') * 1000)
+
+    def seek_back(self):
+        self.position.add(-config.getfloat('continuous_controls', 'seek_step') * 1000)
+
+    # Asks for it afresh, as the volume may have been changed elsewhere since the devices were
+    # cached.
+    def get_volume(self):
+        device = self.get_playback_state().device
+
+        if device is None or device.volume_percent is None:
+            raise NotifiableError('Error', 'No device found')
+
+        return device.volume_percent, 0
+
+    def set_volume(self, volume_percent):
+        self.call_web_method('me/player/volume', 'put', params={'volume_percent': volume_percent})
+
+    # The position keeps moving by itself while playing.
+    def get_position(self):
+        playback = self.get_playback_state()
+        self.track_duration_ms = playback.item.duration_ms if playback.item is not None else None
+
+        return playback.progress_ms or 0, 1000 if playback.is_playing else 0
+
+    def seek(self, position_ms):
+        self.call_web_method('me/player/seek', 'put', params={'position_ms': position_ms})
+
+    @staticmethod
+    def format_time(milliseconds):
+        minutes, seconds = divmod(int(milliseconds) // 1000, 60)
+
+        return '{}:{:02d}'.format(minutes, seconds)
 
     def pause(self):
         self.try_local_method_then_web('pause', 'me/player/pause', 'put')
@@ -82,7 +194,7 @@ class Spotify:
         song = self.get_current_song_info()[0]
 
         if not self.is_saved(self.get_current_song_id()):
-            self.add_songs_to_library(self.get_current_song_id())
+            self.change_library(True, self.get_current_song_id())
             send_notif_with_web_image('Successfully saved',
                                       'Added ' + song + ' to library.',
                                       self.currently_playing_art_url())
@@ -95,35 +207,48 @@ class Spotify:
     def unsave(self):
         song = self.get_current_song_info()[0]
 
-        self.remove_songs_from_library(self.get_current_song_id())
+        self.change_library(False, self.get_current_song_id())
         send_notif_with_web_image('Successfully unsaved',
                                   'Removed ' + song + ' from library.',
                                   self.currently_playing_art_url())
 
     def toggle_shuffle(self):
-        def change_shuffle_with_web_api(response):
-            toggled_shuffle = not response.json().get('shuffle_state')
+        def change_shuffle_with_web_api(playback):
+            toggled_shuffle = not playback.shuffle_state
 
             self.call_web_method('me/player/shuffle', 'put', params={'state': toggled_shuffle})
             send_notif('Shuffle toggled',
                        'Shuffle now {}'.format('enabled' if toggled_shuffle else 'disabled'))
 
-        self.try_local_method_then_web('toggle_shuffle', 'me/player', 'get', change_shuffle_with_web_api)
+        self.try_local_method_then_web('toggle_shuffle', 'me/player', 'get', change_shuffle_with_web_api,
+                                       to_model=PlaybackState.from_json)
 
     def toggle_repeat(self):
         # There are 3 repeat states (track, context, off), so we cannot simply toggle
         # on and off, we must switch between them.
-        def change_state_with_web_api(response):
-            repeat_state = response.json().get('repeat_state')
+        def change_state_with_web_api(playback):
+            repeat_state = playback.repeat_state
             next_state = self.repeat_states[self.repeat_states.index(repeat_state) - 1]
             self.call_web_method('me/player/repeat', 'put', params={'state': next_state})
             send_notif('Repeat changed',
                        'Repeating is now set to: {}'.format(self.get_shuffle_and_repeat_state()[1]))
 
-        self.try_local_method_then_web('toggle_repeat', 'me/player', 'get', change_state_with_web_api)
+        self.try_local_method_then_web('toggle_repeat', 'me/player', 'get', change_state_with_web_api,
+                                       to_model=PlaybackState.from_json)
 
     def play_on_current_device(self):
-        self.call_web_method('me/player', 'put', payload={'device_ids': [self.get_current_device_id()]})
+        device_id = self.get_current_device_id()
+
+        if device_id is None:
+            raise NotifiableError('Device not found', 'Open Spotify on this device and try again.')
+
+        try:
+            self.call_web_method('me/player', 'put', payload={'device_ids': [device_id]})
+        except Exception:
+            # The saved id may be out of date (e.g. after reinstalling Spotify), so it's looked up
+            # again next time.
+            self.devices.invalidate()
+            raise
 
     def toggle_save_monthly_playlist(self):
         song_id = self.get_current_song_id()
@@ -132,181 +257,483 @@ class Spotify:
         song = self.get_current_song_info()[0]
 
         if is_in_playlist:
-            self.remove_song_from_monthly_playlist(song_id)
+            self.change_monthly_playlist(False, song_id)
             send_notif_with_web_image('Successfully removed',
                                       'Removed ' + song + ' from playlist.',
                                       self.currently_playing_art_url())
         else:
-            self.add_song_to_monthly_playlist(song_id)
+            self.change_monthly_playlist(True, song_id)
             send_notif_with_web_image('Successfully added',
                                       'Added ' + song + ' to playlist.',
                                       self.currently_playing_art_url())
 
+    # The play history only has the tracks that commands (or polling) happened to see, so the last
+    # one it has before the current track may have been played hours earlier, with others in
+    # between. Returns the playback state, and the last count different tracks played (most
+    # recent first, the current one included), stopping at the first play that can't have still
+    # been going when the one after it started.
+    def get_recent_tracks(self, count):
+        # From the Web API rather than the local API, so the current track is in the history, and
+        # how far into it playback is known.
+        playback = self.get_playback_state()
+        current_id = playback.item.id if playback.item is not None else None
+
+        plays = self.history.get_recent_plays(count)
+        tracks = self.get_tracks(list(dict.fromkeys(play.track_id for play in plays)))
+        max_gap = config.getfloat('play_history', 'max_gap')
+
+        next_started_at = time.time() - (playback.progress_ms or 0) / 1000
+        recent = {}
+
+        for i, play in enumerate(plays):
+            track = tracks.get(play.track_id)
+            duration = (track.duration_ms or 0) / 1000 if track is not None else 0
+
+            # The current play started next_started_at; every earlier one must have still been
+            # playing (give or take max_gap) when the one after it could have started.
+            if i > 0 or play.track_id != current_id:
+                if play.played_at + duration + max_gap < next_started_at:
+                    break
+
+                next_started_at = play.played_at - duration
+
+            if track is not None:
+                recent.setdefault(track.id, track)
+
+        return playback, list(recent.values())
+
+    # Returns the tracks with track_ids, by id, leaving out any Spotify doesn't know.
+    def get_tracks(self, track_ids):
+        tracks = {}
+
+        # Up to 50 tracks can be looked up at a time.
+        for i in range(0, len(track_ids), 50):
+            body = self.call_web_method('tracks', 'get', params={'ids': ','.join(track_ids[i:i + 50])})
+
+            for json in body.get('tracks', []):
+                if json is not None:
+                    track = Track.from_json(json)
+                    tracks[track.id] = track
+
+        return tracks
+
+    # Saves the track played before the current one, e.g. after skipping it too quickly.
+    def save_previous_track(self):
+        if self.history is None:
+            send_notif('Play history disabled', 'Enable play_history in config.ini to use this.')
+            return
+
+        playback, tracks = self.get_recent_tracks(2)
+        current_id = playback.item.id if playback.item is not None else None
+        track = next((track for track in tracks if track.id != current_id), None)
+
+        if track is None:
+            send_notif('Nothing to save', 'The track played before this one wasn\'t seen.')
+            return
+
+        track_id = track.id
+
+        if not self.is_saved(track_id):
+            self.change_library(True, track_id)
+            send_notif_with_web_image('Successfully saved', 'Added ' + track.name + ' to library.', track.art_url())
+        else:
+            send_notif_with_web_image('Already saved', track.name + ' was already in library.', track.art_url())
+
+    # Adds the last few different tracks played (recent_count in config.ini) to the monthly
+    # playlist, skipping those already in it.
+    def add_recent_to_monthly_playlist(self):
+        if self.history is None:
+            send_notif('Play history disabled', 'Enable play_history in config.ini to use this.')
+            return
+
+        track_ids = [track.id for track in self.get_recent_tracks(config.getint('play_history', 'recent_count'))[1]]
+        in_playlist = self.get_monthly_playlist_track_ids()
+
+        def is_in_playlist(track_id):
+            added = self.get_pending_change('monthly_playlist', track_id)
+
+            return track_id in in_playlist if added is None else added
+
+        # Oldest first, so they're in the playlist in the order they were played.
+        new_track_ids = [track_id for track_id in reversed(track_ids) if not is_in_playlist(track_id)]
+
+        if new_track_ids:
+            self.change_monthly_playlist(True, *new_track_ids)
+
+        send_notif('Successfully added', 'Added {} of the last {} tracks to playlist.'
+                   .format(len(new_track_ids), len(track_ids)))
+
     def show_current_song(self):
         song, artists, album = self.get_current_song_info()
         send_notif_with_web_image(song, ', '.join(artists) + ' - ' + album, self.currently_playing_art_url())
 
     def add_song_to_monthly_playlist(self, song_id):
-        return self.call_web_method(
-            'users/{}/playlists/{}/tracks'.format(self.get_user_id(), self.get_monthly_playlist_id()),
-            'post',
-            params={'uris': 'spotify:track:{}'.format(song_id)}
-        )
+        return self.add_songs_to_monthly_playlist(song_id)
+
+    def add_songs_to_monthly_playlist(self, *song_ids):
+        response = None
+
+        # Up to 100 tracks can be added at a time.
+        for i in range(0, len(song_ids), 100):
+            response = self.call_web_method(
+                'users/{}/playlists/{}/tracks'.format(self.get_user_id(), self.get_monthly_playlist_id()),
+                'post',
+                params={'uris': ','.join('spotify:track:{}'.format(song_id) for song_id in song_ids[i:i + 100])}
+            )
+
+        if self.prefetcher is not None:
+            for song_id in song_ids:
+                self.prefetcher.set_is_in_monthly_playlist(song_id, True)
+
+        return response
 
-    # The API is inconsistent so adding and deleting are different.
     def remove_song_from_monthly_playlist(self, song_id):
-        return self.call_web_method(
-            'users/{}/playlists/{}/tracks'.format(self.get_user_id(), self.get_monthly_playlist_id()),
-            'delete',
-            payload={'tracks': [{'uri': 'spotify:track:{}'.format(song_id)}]}
-        )
+        return self.remove_songs_from_monthly_playlist(song_id)
+
+    # The API is inconsistent so adding and deleting are different.
+    def remove_songs_from_monthly_playlist(self, *song_ids):
+        response = None
+
+        # Up to 100 tracks can be removed at a time.
+        for i in range(0, len(song_ids), 100):
+            response = self.call_web_method(
+                'users/{}/playlists/{}/tracks'.format(self.get_user_id(), self.get_monthly_playlist_id()),
+                'delete',
+                payload={'tracks': [{'uri': 'spotify:track:{}'.format(song_id)} for song_id in song_ids[i:i + 100]]}
+            )
+
+        if self.prefetcher is not None:
+            for song_id in song_ids:
+                self.prefetcher.set_is_in_monthly_playlist(song_id, False)
+
+        return response
+
+    # Adds (or removes) tracks straight away, or after a short while with write batching (see
+    # write_batcher.py), along with other changes made in the meantime.
+    def change_library(self, added, *song_ids):
+        if self.write_batcher is None:
+            return self.send_batched_changes('library', song_ids, added)
+
+        for song_id in song_ids:
+            self.write_batcher.add('library', song_id, added)
+
+    def change_monthly_playlist(self, added, *song_ids):
+        if self.write_batcher is None:
+            return self.send_batched_changes('monthly_playlist', song_ids, added)
+
+        for song_id in song_ids:
+            self.write_batcher.add('monthly_playlist', song_id, added)
+
+    def send_batched_changes(self, collection, song_ids, added):
+        if collection == 'library':
+            send = self.add_songs_to_library if added else self.remove_songs_from_library
+        else:
+            send = self.add_songs_to_monthly_playlist if added else self.remove_songs_from_monthly_playlist
+
+        return send(*song_ids)
+
+    # Whether song_id is about to be added to (True) or removed from (False) collection by write
+    # batching, or None.
+    def get_pending_change(self, collection, song_id):
+        if self.write_batcher is None:
+            return None
+
+        return self.write_batcher.get_pending(collection, song_id)
 
     def get_current_song_info(self):
-        def get_track_from_web_api(response):
-            return response.json().get('item')
+        track = self.get_current_track()
+
+        return track.name, track.artists, track.album
+
+    def get_current_track(self):
+        return self.try_local_method_then_web('get_current_track', 'me/player', 'get', lambda playback: playback.item,
+                                              to_model=PlaybackState.from_json, use_prefetched=True)
+
+    # use_prefetched should only be used for what depends on the current track, as e.g. the
+    # shuffle state could have changed since it was prefetched.
+    def get_playback_state(self, use_prefetched=False):
+        if use_prefetched and self.prefetcher is not None:
+            playback = self.prefetcher.get_playback()
+
+            if playback is not None:
+                return playback
+
+        return self.call_web_method('me/player', 'get', to_model=PlaybackState.from_json)
+
+    # Only accounts that use monthly playlists (one of monthly_playlist_methods is bound, or a
+    # playlist has been used before) get them made ahead of time, or by prefetching, so nobody
+    # else finds one in their library.
+    def uses_monthly_playlist(self):
+        if not self.monthly_playlist_used:
+            with open_shelf(self.web_api.info_file) as shelf:
+                self.monthly_playlist_used = bool(shelf.get('monthly_playlist_ids')) or 'monthly_playlist_id' in shelf
+
+        return self.monthly_playlist_used
 
-        track = self.try_local_method_then_web('get_current_track', 'me/player', 'get', get_track_from_web_api)
+    def use_monthly_playlist(self):
+        self.monthly_playlist_used = True
 
-        song = track.get('name')
-        artists = [x.get('name') for x in track.get('artists')]
-        album = track.get('album').get('name')
+        if config.getboolean('monthly_playlist', 'precreate') and self.monthly_playlist_scheduler is None:
+            self.monthly_playlist_scheduler = MonthlyPlaylistScheduler(
+                self.get_monthly_playlist_id, lead_time=config.getfloat('monthly_playlist', 'lead_time'))
+            self.monthly_playlist_scheduler.start()
 
-        return song, artists, album
+    # Playlist ids are saved by month (e.g. 'October 2026'), so next month's can be found ahead of
+    # time by the MonthlyPlaylistScheduler without replacing this month's.
+    def get_monthly_playlist_id(self, when=None):
+        when = when or datetime.datetime.now()
+        month, year = when.strftime('%B'), str(when.year)
+        month_key = '{} {}'.format(month, year)
 
-    def get_monthly_playlist_id(self):
-        now = datetime.datetime.now()
-        month, year = now.strftime('%B'), str(now.year)
+        # Stops the scheduler and a command from both creating the same playlist.
+        with self.monthly_playlist_lock:
+            with open_shelf(self.web_api.info_file) as shelf:
+                playlist_ids = shelf.get('monthly_playlist_ids', {})
 
-        with shelve.open('.info') as shelf:
-            # Check if months and years are available and are correct, if not, update
-            # playlist id.
-            if 'month' not in shelf or shelf['month'] != month:
-                shelf['month'] = month
-                shelf['monthly_playlist_id'] = self.__fetch_playlist_id(month, year, 0)
-            if 'year' not in shelf or shelf['year'] != year:
-                shelf['year'] = year
-                shelf['monthly_playlist_id'] = self.__fetch_playlist_id(month, year, 0)
-            return shelf['monthly_playlist_id']
+                # Playlist ids used to be saved one at a time, together with their month and year.
+                if 'monthly_playlist_id' in shelf:
+                    if shelf.get('month') == month and shelf.get('year') == year:
+                        playlist_ids[month_key] = shelf['monthly_playlist_id']
+
+                    # Older versions could save the id without the year, if fetching it failed.
+                    for key in ('month', 'year', 'monthly_playlist_id'):
+                        shelf.pop(key, None)
+
+                    shelf['monthly_playlist_ids'] = playlist_ids
+
+                if month_key in playlist_ids:
+                    return playlist_ids[month_key]
+
+            playlist_id = self.__fetch_playlist_id(month, year, 0)
+
+            with open_shelf(self.web_api.info_file) as shelf:
+                playlist_ids = shelf.get('monthly_playlist_ids', {})
+                playlist_ids[month_key] = playlist_id
+
+                # Only the current and next months are ever needed.
+                shelf['monthly_playlist_ids'] = dict(list(playlist_ids.items())[-2:])
+
+            return playlist_id
 
     def get_user_id(self):
-        with shelve.open('.info') as shelf:
+        with open_shelf(self.web_api.info_file) as shelf:
             if 'user_id' not in shelf:
                 shelf['user_id'] = self.__fetch_user_id()
             return shelf['user_id']
 
     def __fetch_user_id(self):
-        return self.call_web_method('me', 'get').json().get('id')
+        return self.call_web_method('me', 'get').get('id')
 
     def __fetch_playlist_id(self, month, year, offset):
-        response = self.call_web_method('me/playlists', 'get',
-                                        params={'limit': 50,
-                                                'offset': offset}).json()
+        page = self.call_web_method('me/playlists', 'get',
+                                    params={'limit': 50,
+                                            'offset': offset},
+                                    to_model=Paging.from_json)
 
         playlist_id = None
 
-        for playlist in response.get('items'):
+        for playlist in page.items:
             if str(playlist.get('name')).lower() == '{} {}'.format(month, year).lower():
                 playlist_id = playlist.get('id')
 
         if playlist_id is not None:
             return playlist_id
         # Check through all pages to look for our playlist
-        elif playlist_id is None and Spotify.is_paging(response):
-            return self.__fetch_playlist_id(month, year, offset + response.get('limit'))
+        elif playlist_id is None and page.has_next:
+            return self.__fetch_playlist_id(month, year, offset + page.limit)
         else:
             return self.call_web_method(
                 'users/{}/playlists'.format(self.get_user_id()),
                 'post',
                 payload={'name': '{} {}'.format(month.capitalize(), year)}
-            ).json().get('id')
+            ).get('id')
+
+    def is_in_monthly_playlist(self, song_id, offset=0):
+        added = self.get_pending_change('monthly_playlist', song_id)
 
-    def is_in_monthly_playlist(self, song_id, offset):  # TODO refactor into a paging-handling method
+        if added is not None:
+            return added
+
+        if offset == 0 and self.prefetcher is not None:
+            is_in_playlist = self.prefetcher.get_is_in_monthly_playlist(song_id)
+
+            if is_in_playlist is not None:
+                return is_in_playlist
+
+        return self.fetch_is_in_monthly_playlist(song_id, offset)
+
+    def fetch_is_in_monthly_playlist(self, song_id, offset):  # TODO refactor into a paging-handling method
         playlist_tracks = self.call_web_method(
             'playlists/{}/tracks'.format(self.get_monthly_playlist_id()),
             'get',
-            params={'offset': offset}
-        ).json()
+            params={'offset': offset},
+            to_model=lambda json: Paging.from_json(json, lambda item: Track.from_json(item.get('track')))
+        )
 
-        exists = len([x for x in playlist_tracks.get('items') if x.get('track').get('id') == song_id]) > 0
+        exists = any(track is not None and track.id == song_id for track in playlist_tracks.items)
 
         # Run this same method with the next set of results
-        if not exists and Spotify.is_paging(playlist_tracks):
-            return self.is_in_monthly_playlist(song_id, offset + playlist_tracks.get('limit'))
+        if not exists and playlist_tracks.has_next:
+            return self.fetch_is_in_monthly_playlist(song_id, offset + playlist_tracks.limit)
         else:
             return exists
 
-    # If a response contains a 'next', it means there are more results that we will then have to request.
-    @staticmethod
-    def is_paging(json):
-        return json.get('next') is not None
+    def get_monthly_playlist_track_ids(self):
+        track_ids = set()
+        offset = 0
+
+        while True:
+            playlist_tracks = self.call_web_method(
+                'playlists/{}/tracks'.format(self.get_monthly_playlist_id()),
+                'get',
+                params={'offset': offset},
+                to_model=lambda json: Paging.from_json(json, lambda item: Track.from_json(item.get('track')))
+            )
+
+            track_ids.update(track.id for track in playlist_tracks.items if track is not None)
+
+            if not playlist_tracks.has_next:
+                return track_ids
+
+            offset += playlist_tracks.limit
 
     def add_songs_to_library(self, *song_ids):
-        return self.call_web_method('me/tracks', 'put', payload={'ids': song_ids})
+        response = None
+
+        # Up to 50 tracks can be saved at a time.
+        for i in range(0, len(song_ids), 50):
+            response = self.call_web_method('me/tracks', 'put', payload={'ids': song_ids[i:i + 50]})
+
+        if self.prefetcher is not None:
+            for song_id in song_ids:
+                self.prefetcher.set_is_saved(song_id, True)
+
+        return response
         # return self.web_api.put('me/tracks', payload={'ids': song_ids})
 
+    # Always asks the Web API - use self.devices for a cached list.
     def get_available_devices(self):
-        return self.call_web_method('me/player/devices', 'get').json().get('devices')
+        return [Device.from_json(device) for device in self.call_web_method('me/player/devices', 'get').get('devices')]
 
-    # The active device is the one currently playing music, not necessarily the one currently
-    # being used by the user (for example, music could be playing through a phone, but the user
-    # is on their computer).
     def get_active_device(self):
-        devices = self.get_available_devices()
-        try:
-            return next(device for device in devices if device.get('is_active'))
-
-        except StopIteration:
-            return None
+        return self.devices.get_active_device()
 
     def get_current_song_id(self):
-        def get_id_from_web_api(response):
-            return response.json().get('item').get('id')
-
-        return self.try_local_method_then_web('get_track_id', 'me/player', 'get', get_id_from_web_api, 'get')
+        return self.try_local_method_then_web('get_track_id', 'me/player', 'get', lambda playback: playback.item.id,
+                                              to_model=PlaybackState.from_json, use_prefetched=True)
 
     def is_saved(self, song_id):
+        added = self.get_pending_change('library', song_id)
+
+        if added is not None:
+            return added
+
+        if self.prefetcher is not None:
+            is_saved = self.prefetcher.get_is_saved(song_id)
+
+            if is_saved is not None:
+                return is_saved
+
+        return self.fetch_is_saved(song_id)
+
+    def fetch_is_saved(self, song_id):
         # Returns a list of boolean values matching each id we give it; with only one, we get the first and only value
-        return self.call_web_method('me/tracks/contains', 'get', params={'ids': [song_id]}).json()[0]
+        return self.call_web_method('me/tracks/contains', 'get', params={'ids': [song_id]})[0]
 
     def currently_playing_art_url(self, track=None, quality=2):
         if track is None:
             try:
-                track = self.try_local_method_then_web('', 'me/player', 'get').json().get('item')
+                track = self.get_playback_state(use_prefetched=True).item
 
             except ConnectionError:
                 return None
 
-        images = track.get('album').get('images')
-
-        # We don't need very high quality images for notifications, so we get
-        # the images at the end of the list (which is ordered by quality).
-        return images[-quality if len(images) >= 2 else 0].get('url')
+        return track.art_url(quality)
 
     def remove_songs_from_library(self, *song_ids):
-        return self.call_web_method('me/tracks', 'delete', payload={'ids': song_ids})
+        response = None
+
+        # Up to 50 tracks can be removed at a time.
+        for i in range(0, len(song_ids), 50):
+            response = self.call_web_method('me/tracks', 'delete', payload={'ids': song_ids[i:i + 50]})
+
+        if self.prefetcher is not None:
+            for song_id in song_ids:
+                self.prefetcher.set_is_saved(song_id, False)
+
+        return response
 
     def is_playing(self):
-        return self.try_local_method_then_web('is_playing', 'me/player', 'get').json().get('is_playing')
+        return self.try_local_method_then_web('is_playing', 'me/player', 'get', lambda playback: playback.is_playing,
+                                              to_model=PlaybackState.from_json)
 
     def get_shuffle_and_repeat_state(self):
-        response = self.call_web_method('me/player', 'get').json()
-        return response.get('shuffle_state'), response.get('repeat_state')
+        playback = self.get_playback_state()
+        return playback.shuffle_state, playback.repeat_state
 
     def get_current_device_id(self):
-        return next(x.get('id') for x in self.call_web_method('me/player/devices', 'get').json().get('devices') if
-                    x.get('name') == get_device_name())
+        return self.devices.get_this_device_id()
 
-    # For every method, we first try a local API, and then move onto the Web API as a fallback.
+    # Methods the local API has are run with it, falling back to the Web API if it fails, except
+    # for routed_methods, which are run by whichever has been fastest (see backend_router.py).
+    # Those only fall back from the Web API to the local API if the request wasn't sent: other
+    # errors have already been notified, and a timed out request may still have gone through.
     def try_local_method_then_web(self, local_method_name, web_method_name, rest_function_name,
-                                  do_with_web_result=lambda x: x, params=None, payload=None):
-        try:
-            return getattr(self.local_api, local_method_name)()
+                                  do_with_web_result=lambda x: x, params=None, payload=None, to_model=None,
+                                  use_prefetched=False):
+        def call_local():
+            with tracing.span('local method', method=local_method_name):
+                return getattr(self.local_api, local_method_name)()
+
+        prefetched = None
+        if use_prefetched and web_method_name == 'me/player' and rest_function_name == 'get' \
+                and self.prefetcher is not None:
+            prefetched = self.prefetcher.get_playback()
+
+        def call_web():
+            if prefetched is not None:
+                return do_with_web_result(prefetched)
 
-        except AttributeError:
             return do_with_web_result(
-                self.call_web_method(web_method_name, rest_function_name, params=params, payload=payload))
+                self.call_web_method(web_method_name, rest_function_name, params=params, payload=payload,
+                                     to_model=to_model))
+
+        if not hasattr(getattr(self, 'local_api', None), local_method_name):
+            return call_web()
+
+        backends = {'local': (call_local, AttributeError), 'web': (call_web, RequestNotSentError)}
+        router = self.backend_router if local_method_name in routed_methods else None
+        order = router.get_order(local_method_name, list(backends)) if router is not None else list(backends)
+
+        for i, backend in enumerate(order):
+            call, failure = backends[backend]
+            start = time.perf_counter()
 
-    def call_web_method(self, method, rest_function_name, params=None, payload=None):
+            # Prefetched answers take no request, so say nothing about how the Web API is doing.
+            records = router is not None and (backend != 'web' or prefetched is None)
+
+            try:
+                result = call()
+            except failure:
+                if records:
+                    router.record(local_method_name, backend, time.perf_counter() - start, failed=True)
+
+                if i == len(order) - 1:
+                    raise
+
+                continue
+
+            if records:
+                router.record(local_method_name, backend, time.perf_counter() - start)
+
+            return result
+
+    # Returns the decoded response body, converted with to_model if given (e.g. PlaybackState.from_json).
+    def call_web_method(self, method, rest_function_name, params=None, payload=None, to_model=None):
+        with tracing.span('call_web_method', method=method, rest_function_name=rest_function_name):
+            return self.handle_web_method(method, rest_function_name, params, payload, to_model)
+
+    def handle_web_method(self, method, rest_function_name, params, payload, to_model):
         # 'get' functions don't have payloads.
         if rest_function_name == 'get':
             response = getattr(self.web_api, rest_function_name)(method, params=params)
@@ -315,7 +742,7 @@ class Spotify:
         elif method == 'me/player' and rest_function_name == 'put':
             response = getattr(self.web_api, rest_function_name)(method, params=params,
                                                                  payload={
-                                                                     'device_ids': [self.get_active_device().get('id')],
+                                                                     'device_ids': [self.get_active_device().id],
                                                                      'play': True} if payload is None else payload)
         else:
             response = getattr(self.web_api, rest_function_name)(method, params=params, payload=payload)
@@ -325,27 +752,57 @@ class Spotify:
         # 'get' with no further method returns information about the user's playback.
         # 204s are usually successes, but in this case it means no active devices exist.
         if status_code == 204 and method == 'me/player' and rest_function_name == 'get':
-            send_notif('Error', 'No device found')
-            raise AlreadyNotifiedException
+            raise NotifiableError('Error', 'No device found')
         elif 200 <= status_code <= 299:  # These responses are fine
-            return response
+            body = decode(response)
+            result = body if to_model is None or body is None else to_model(body)
+
+            if status_code == 200 and method == 'me/player' and rest_function_name == 'get':
+                self.observe_playback(result if isinstance(result, PlaybackState) else PlaybackState.from_json(body))
 
-        info = response.json()
+            return result
+
+        info = decode(response) or {}
 
         # Player errors also return a reason, which we use to notify with the appropriate message from config.ini,
         # though it appears nearly all reasons will always be UNKNOWN, an issue with the Spotify API.
         if 'error' in info and 'reason' in info.get('error'):
             reason = info.get('error').get('reason')
+            # Our cached devices (and possibly this machine's device id) are out of date.
+            if reason in ('NO_ACTIVE_DEVICE', 'DEVICE_NOT_CONTROLLABLE'):
+                self.devices.invalidate()
             response = config['player_error_strings'][reason]
-            send_notif('Player Error', response)
-            raise AlreadyNotifiedException
+            raise NotifiableError('Player Error', response)
 
         if status_code >= 300:
             logging.warning('Request {} failed with code {}'.format(response.text, status_code))
-            logging.warning('Fail message: {}'.format(response.json().get('error').get('message')))
+            logging.warning('Fail message: {}'.format(info.get('error', {}).get('message')))
             raise Exception
 
-        return response
+        return decode(response)
+
+    # Every playback response tells us the active device, which saves a devices lookup later, and
+    # what is playing, for prefetching and the play history.
+    def observe_playback(self, playback, prefetch=True):
+        self.devices.observe_active_device(playback.device)
+
+        if prefetch and self.prefetcher is not None:
+            self.prefetcher.observe_playback(playback)
+
+        if self.history is not None and playback.item is not None:
+            self.history.observe(playback.item.id, playback.context_uri,
+                                 playback.device.id if playback.device is not None else None)
+
+    # Used by the HistoryRecorder, which shouldn't notify about anything (e.g. no active device),
+    # nor prefetch for tracks nobody has asked about.
+    def poll_playback(self):
+        response = self.web_api.get('me/player')
+
+        if response.status_code == 200:
+            self.observe_playback(PlaybackState.from_json(decode(response)), prefetch=False)
+
+    def is_current_song_saved(self):
+        return self.is_saved(self.get_current_song_id())
 
     def toggle_save(self):
         is_saved = self.is_saved(self.get_current_song_id())
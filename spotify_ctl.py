@@ -0,0 +1,74 @@
+# Sends commands to a running Spotify Helper through its control socket, e.g.
+#
+#   python spotify_ctl.py next show_current_song
+#   printf 'toggle_save\nget_current_song_info\n' | python spotify_ctl.py -
+#
+# Commands are sent as soon as they're read, without waiting for the results of earlier ones, and
+# results are printed as they come back, so a pipe that stays open (e.g. from a status bar) gets
+# each result straight away. Commands read from stdin get one line of JSON back each, in order.
+import configparser
+import json
+import os
+import socket
+import sys
+import threading
+
+from control_server import get_socket_path
+
+config = configparser.ConfigParser()
+config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
+
+
+def send_commands(commands, socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        threading.Thread(target=send_all, args=(connection, commands), daemon=True).start()
+
+        with connection.makefile('rb') as replies:
+            for reply in replies:
+                yield json.loads(reply)
+
+
+def send_all(connection, commands):
+    try:
+        for command in commands:
+            connection.sendall((command + '\n').encode('utf-8'))
+
+        # Tells the daemon we're done sending, so it closes the connection after the last result.
+        connection.shutdown(socket.SHUT_WR)
+    except OSError:  # The daemon went away, which reading the replies finds out too.
+        pass
+
+
+def main(args):
+    if not args:
+        sys.exit('Usage: spotify_ctl.py COMMAND [COMMAND ...], or - to read commands from stdin')
+
+    from_stdin = args == ['-']
+    commands = (line.strip() for line in sys.stdin if line.strip()) if from_stdin else args
+
+    failed = False
+
+    try:
+        for reply in send_commands(commands, get_socket_path(config['control']['socket_path'])):
+            failed = failed or not reply.get('ok')
+
+            if from_stdin:
+                print(json.dumps(reply), flush=True)
+            elif reply.get('ok'):
+                result = reply.get('result')
+
+                # Commands like 'next' have nothing to show.
+                if result is not None:
+                    print(result if isinstance(result, str) else json.dumps(result))
+            else:
+                print('{}: {}'.format(reply.get('command'), reply.get('error')), file=sys.stderr)
+
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit('Spotify Helper does not seem to be running')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
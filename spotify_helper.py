@@ -6,16 +6,21 @@ import sys
 import os
 import threading
 import traceback
-from collections import deque
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
 
 import requests
 from pynput import keyboard
-from pynput.keyboard import Key, KeyCode
 
-from spotify import Spotify
+import control_server
+import tracing
+from chord_matcher import ChordMatcher
+from control_server import ControlServer
+from deadlines import Deadline
+from spotify import Spotify, monthly_playlist_methods
 from notif_handler import send_notif
-from exceptions import AlreadyNotifiedException
+from exceptions import DeadlineExceededError, NotifiableError
+from listener_process import ListenerProcess
 
 config = configparser.ConfigParser()
 config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
@@ -27,49 +32,53 @@ class SpotifyHelper:
     def __init__(self):
         try:
             self.spotify = Spotify()
+
+            # Other accounts are used by prefixing methods with their name, e.g. 'work:toggle_save'.
+            self.spotifies = {None: self.spotify}
+            for account in SpotifyHelper.get_account_names():
+                self.spotifies[account] = Spotify(account)
         except requests.exceptions.ConnectionError:
             send_notif('Spotify Helper closed', 'Check you have a working internet connection.')
             sys.exit(1)
 
-        self.currently_pressed_keys = list()
-        self.looking_for = {}
-        self.has_released_key = True
+        self.repeatable_methods = ast.literal_eval(config['continuous_controls']['repeatable'])
+        self.chord_matcher = ChordMatcher(self.queue_method, self.repeatable_methods)
 
         self.load_bindings_from_file(bindings_file)
-        self.atomic_method_groups = SpotifyHelper.get_atomic_method_groups()
-        self.method_group_thread_queues = self.get_method_group_thread_queues()
-
-    def load_bindings_from_file(self, file):
-        with open(file) as file:
-            for line in file:
-                method_and_keycodes = line.split('=')
-
-                method = method_and_keycodes[0]  # The method to run
-                rest_of_line = method_and_keycodes[1]  # Includes bindings we have to parse
-
-                # Allows inline comments in the bindings file
-                if '#' in rest_of_line:
-                    rest_of_line = rest_of_line[:rest_of_line.index('#')]
-
-                bindings = rest_of_line.rstrip()
 
-                if bindings != '':
-                    # Can have multiple bindings split by commas.
-                    for binding in bindings.split(','):
-                        keys = list()
-                        for single_key in binding.split('+'):
-                            keys.append(self.get_key_from_string(single_key))
+        for method in self.chord_matcher.get_bound_methods():
+            account, method_name = SpotifyHelper.split_account(method)
 
-                        keys_tuple = tuple(keys)
+            if method_name in monthly_playlist_methods and account in self.spotifies:
+                self.spotifies[account].use_monthly_playlist()
 
-                        # looking_for is a dictionary where the keys are the bindings and the values
-                        # are all the methods linked to those keys, as you can have multiple bindings
-                        # per method and vice versa.
+        # With bounded resources (see config.ini), commands past the limits are dropped.
+        self.queue_size = 0  # Unbounded
+        self.command_pool = None
+        self.command_slots = None
+        self.dropped_count = 0
+        if config.getboolean('resources', 'bounded'):
+            self.queue_size = config.getint('resources', 'queue_size')
+            command_threads = config.getint('resources', 'command_threads')
+            self.command_pool = ThreadPoolExecutor(command_threads, thread_name_prefix='command')
+            # Running and waiting, as the pool's own queue has no limit.
+            self.command_slots = threading.BoundedSemaphore(command_threads + self.queue_size)
 
-                        if keys_tuple not in self.looking_for.keys():
-                            self.looking_for[keys_tuple] = []
+        self.atomic_method_groups = SpotifyHelper.get_atomic_method_groups()
+        # Looked up for every queued method, so worked out once here.
+        self.method_groups = {method: group for group, methods in self.atomic_method_groups.items()
+                              for method in methods}
+        # Every account gets its own queues, so one account's slow commands don't hold up another's.
+        self.method_group_thread_queues = {account: self.get_method_group_thread_queues()
+                                           for account in self.spotifies}
+
+        self.control_server = None
+        if config.getboolean('control', 'enabled') and control_server.is_supported():
+            self.control_server = ControlServer(control_server.get_socket_path(config['control']['socket_path']),
+                                                self.queue_method, self.is_method)
 
-                        self.looking_for[keys_tuple].append(method)
+    def load_bindings_from_file(self, file):
+        self.chord_matcher.load_bindings_from_file(file)
 
     # Some methods can run at the same time, others cannot: we group
     # them as 'independent', which can be run in any order, 'self_dependent',
@@ -81,12 +90,12 @@ class SpotifyHelper:
             # If it's self dependent, make a new thread group for each method
             if group == 'self_dependent':
                 for method in self.atomic_method_groups[group]:
-                    method_group_thread_queues[method] = deque([])
-                    self.start_queue_listening_thread(method_group_thread_queues[method])
+                    method_group_thread_queues[method] = Queue(self.queue_size)
+                    self.start_queue_listening_thread(method_group_thread_queues[method], method)
             # If it's a custom group, set a single queue for that entire group
             elif group != 'independent':
-                method_group_thread_queues[group] = deque([])
-                self.start_queue_listening_thread(method_group_thread_queues[group])
+                method_group_thread_queues[group] = Queue(self.queue_size)
+                self.start_queue_listening_thread(method_group_thread_queues[group], group)
 
         return method_group_thread_queues
 
@@ -101,95 +110,165 @@ class SpotifyHelper:
 
         return thread_groups
 
-    def start_queue_listening_thread(self, queue):
+    @staticmethod
+    def get_account_names():
+        return ast.literal_eval(config['accounts']['names'])
+
+    # Splits 'work:toggle_save' into ('work', 'toggle_save'), and 'toggle_save' into (None, 'toggle_save').
+    @staticmethod
+    def split_account(method):
+        account, _, method_name = method.rpartition(':')
+
+        return account or None, method_name
+
+    # Threads are named after their group, which shows in profiles.
+    def start_queue_listening_thread(self, queue, name):
         threading.Thread(target=self.check_methods_to_run,
                          args=(queue,),  # A singleton tuple
+                         name='queue-{}'.format(name),
                          daemon=True).start()
 
-    def queue_method(self, method):
-        def get_method_group(method):
-            for group in self.atomic_method_groups:
-                if method in self.atomic_method_groups[group]:
-                    return group
+    def is_method(self, method):
+        account, method = SpotifyHelper.split_account(method)
+
+        return account in self.spotifies and method in self.method_groups
+
+    # If a future is given, it gets the method's result (or exception) once it has run, which
+    # is how the control socket sends results back.
+    def queue_method(self, method, future=None):
+        with tracing.span('queue_method', method=method):
+            self.queue_method_to_group(method, future, tracing.start_flow(method))
+
+    def queue_method_to_group(self, method, future, flow):
+        account, method_name = SpotifyHelper.split_account(method)
+
+        if account not in self.spotifies:
+            logging.warning('Unknown account in {}, add it to config.ini'.format(method))
+
+            if future is not None:
+                future.set_exception(ValueError('Unknown account: {}'.format(account)))
+            return
+
+        queues = self.method_group_thread_queues[account]
+        group = self.method_groups.get(method_name)
 
         # Independent groups send just that method to a thread to be run
-        if method in self.get_atomic_method_groups()['independent']:
-            self.start_queue_listening_thread(deque([method]))
+        if group == 'independent':
+            if self.command_pool is None:
+                threading.Thread(target=self.run_method, args=(method, future, flow),
+                                 name='command-{}'.format(method), daemon=True).start()
+            elif self.command_slots.acquire(blocking=False):
+                self.command_pool.submit(self.run_pooled_method, method, future, flow)
+            else:
+                self.drop_method(method, future)
+            return
+
         # Self-dependent & custom groups add their method to the appropriate queue
-        elif method in self.get_atomic_method_groups()['self_dependent']:
-            self.method_group_thread_queues[method].append(method)
-        else:
-            self.method_group_thread_queues[get_method_group(method)].append(method)
+        try:
+            queues[method_name if group == 'self_dependent' else group].put_nowait((method, future, flow))
+        except Full:
+            self.drop_method(method, future)
+
+    def run_pooled_method(self, method, future, flow):
+        try:
+            self.run_method(method, future, flow)
+        finally:
+            self.command_slots.release()
+
+    # Only happens with bounded resources, when commands come in faster than they can be run.
+    def drop_method(self, method, future):
+        self.dropped_count += 1
+
+        # Floods of commands would otherwise fill the log.
+        if self.dropped_count % 100 == 1:
+            logging.warning('Dropped {}, as too many commands are waiting to run ({} dropped so far)'
+                            .format(method, self.dropped_count))
+
+        if future is not None:
+            future.set_exception(RuntimeError('Too many commands are waiting to run'))
 
     # Given a queue, keep checking it, running methods in the order
     # they show up.
     def check_methods_to_run(self, method_queue):
         while True:
-            if len(method_queue) > 0:
-                self.run_method(method_queue.popleft())
-            else:
-                # If there are no operations, we don't want to be checking too often
-                sleep(0.1)
+            # Blocks until there is something to run.
+            self.run_method(*method_queue.get())
+
+    # flow comes from tracing.start_flow() when the method was queued.
+    def run_method(self, method, future=None, flow=None):
+        account, method_name = SpotifyHelper.split_account(method)
 
-    def run_method(self, method):
         try:
-            getattr(self.spotify, method)()
+            # Every request the method makes shares this budget, so it finishes (or fails) in time.
+            with tracing.span('command', method=method), Deadline(config.getfloat('deadlines', 'command_budget')):
+                tracing.finish_flow(flow, method)
+                result = getattr(self.spotifies[account], method_name)()
 
-        except ConnectionError:
-            send_notif('Connection Error', 'Internet connection not available')
-        except AlreadyNotifiedException:
-            pass
         except Exception as e:
-            send_notif('Error', 'Something went wrong')
-            logging.error('{}:{}'.format(e, traceback.format_exc()))
-            traceback.print_exc()
+            # Commands from the control socket get their errors back instead, so e.g. a status bar
+            # polling while Spotify is closed doesn't notify every time.
+            if future is None:
+                SpotifyHelper.notify_method_error(e)
+            else:
+                if not isinstance(e, (ConnectionError, NotifiableError)):
+                    SpotifyHelper.log_method_error(e)
 
-    def on_press(self, key):
-        # Keys are unique in each binding, as it makes no sense to have ctrl+ctrl+f5, for example.
-        # Also prevents the same key being added more than once if held down too long, which happens
-        # on some systems.
-        if key not in self.currently_pressed_keys:
-            self.currently_pressed_keys.append(key)
+                future.set_exception(e)
+        else:
+            if future is not None:
+                future.set_result(result)
+
+    @staticmethod
+    def notify_method_error(e):
+        if isinstance(e, DeadlineExceededError):
+            send_notif('Timed out', 'Spotify took too long to respond')
+        elif isinstance(e, ConnectionError):
+            send_notif('Connection Error', 'Internet connection not available')
+        elif isinstance(e, NotifiableError):
+            send_notif(e.title, e.text)
+        else:
+            send_notif('Error', 'Something went wrong')
+            SpotifyHelper.log_method_error(e)
 
-        for key_tuple, methods in self.looking_for.items():
-            # has_released_key avoids running the same methods for the same keyboard
-            # press - must release a key to run it again.
-            if self.currently_pressed_keys == list(key_tuple) and self.has_released_key:
-                for method in methods:
-                    self.queue_method(method)
+    @staticmethod
+    def log_method_error(e):
+        logging.error('{}:{}'.format(e, traceback.format_exc()))
+        traceback.print_exc()
 
-                self.has_released_key = False
+    def on_press(self, key):
+        with tracing.span('on_press'):
+            self.chord_matcher.on_press(key)
 
     def on_release(self, key):
-        self.has_released_key = True
+        self.chord_matcher.on_release(key)
 
-        # We ignore the key argument as dead/modified keys (e.g. shift+letter) can
-        # pollute the currently_pressed_keys list.
-        try:
-            self.currently_pressed_keys.pop()
+    # Begins the keyboard listener, either on a thread here or in its own process.
+    def run(self):
+        if config.getboolean('listener', 'separate_process'):
+            self.listener = ListenerProcess(self.queue_method, bindings_file, self.repeatable_methods).start()
+        else:
+            self.listener = keyboard.Listener(
+                    on_press=self.on_press,
+                    on_release=self.on_release)
+            self.listener.name = 'keyboard-listener'
+            self.listener.start()
 
-        except IndexError:  # Sometimes it's already empty so raises this exception, to be ignored.
-            pass
+        if self.control_server is not None:
+            self.control_server.start()
 
-    # Get pynput key from a string - modifier keys are captured in the try statement,
-    # while normal letter keys are obtained from the KeyCode.from_char() method.
-    @staticmethod
-    def get_key_from_string(key_str):
-        try:
-            return getattr(Key, key_str)
+    def stop(self):
+        self.listener.stop()
 
-        except AttributeError:
-            return KeyCode.from_char(key_str)
+        if self.control_server is not None:
+            self.control_server.stop()
 
-    # Begins the keyboard listener.
-    def run(self):
-        self.listener = keyboard.Listener(
-                on_press=self.on_press,
-                on_release=self.on_release)
-        self.listener.start()
+        if self.command_pool is not None:
+            self.command_pool.shutdown(wait=False)
 
-    def stop(self):
-        self.listener.stop()
+        # Sends changes write batching is still holding back.
+        for spotify in self.spotifies.values():
+            if spotify.write_batcher is not None:
+                spotify.write_batcher.flush()
 
 
 if __name__ == '__main__':
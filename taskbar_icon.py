@@ -1,18 +1,26 @@
 # Is the main app, and needs to be the main thread for pystray to work correctly.
 import os
+import signal
 import subprocess
 import platform
 import logging
+import threading
 import traceback
 
 from PIL import Image
 from pystray import Icon, Menu, MenuItem
+from profiler import SamplingProfiler
 from spotify_helper import SpotifyHelper, bindings_file
 from notif_handler import send_notif
 
-logging.basicConfig(filename='spotify-helper.log', level=logging.INFO,
+log_file = 'spotify-helper.log'
+
+logging.basicConfig(filename=log_file, level=logging.INFO,
                     format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
 
+# Profiles are saved next to the log, to be sent along with it.
+profiler = SamplingProfiler(os.path.dirname(os.path.abspath(log_file)))
+
 
 # Opens the bindings file in the default text editor
 def open_bindings_file():
@@ -27,6 +35,14 @@ def open_bindings_file():
         subprocess.call(('xdg-open', bindings_file))
 
 
+def toggle_profiling():
+    if not profiler.is_running:
+        profiler.start()
+        send_notif('Profiling', 'Stop profiling to save what Spotify Helper has been doing.')
+    else:
+        send_notif('Profile saved', profiler.stop())
+
+
 if __name__ == "__main__":
     # Called after icon is set up due to threading issues.
     spotify_helper = SpotifyHelper()
@@ -48,6 +64,9 @@ if __name__ == "__main__":
         MenuItem(
             text='Edit bindings',
             action=open_bindings_file),
+        MenuItem(
+            text=lambda item: 'Stop profiling' if profiler.is_running else 'Start profiling',
+            action=toggle_profiling),
         Menu.SEPARATOR,
         MenuItem(
             text='Quit',
@@ -55,6 +74,11 @@ if __name__ == "__main__":
         ),
     ))
 
+    # e.g. 'kill -USR2 <pid>', where there's no tray to click. Handled on a thread, as stopping
+    # writes the profile out.
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=toggle_profiling).start())
+
     # After icon starts running, we start the keyboard listener thread (together with the main
     # Spotify Helper code), since on macOS pystray won't work if pynput runs first, as the latter seems
     # to call a Mac _MainThread function which pystray then tries to call again but is not allowed - running
@@ -0,0 +1,126 @@
+# Optional tracing of every stage between a key press and its notification, written as Chrome
+# trace events (https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU),
+# which can be opened in chrome://tracing or https://ui.perfetto.dev.
+import configparser
+import contextlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+
+config = configparser.ConfigParser()
+config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
+
+enabled = config.getboolean('tracing', 'enabled')
+
+null_span = contextlib.nullcontext()
+flow_ids = itertools.count(1)
+
+trace_logger = logging.getLogger('spotify-helper.trace')
+trace_logger.propagate = False  # Keeps trace events out of spotify-helper.log
+
+# Threads whose names have already been written to the current trace file.
+named_threads = set()
+
+
+# Trace viewers accept a JSON array without its closing bracket, so every file just starts with
+# one and events are appended to it.
+class TraceFileHandler(logging.handlers.RotatingFileHandler):
+
+    def _open(self):
+        stream = super()._open()
+
+        if stream.tell() == 0:
+            stream.write('[\n')
+
+        return stream
+
+    def doRollover(self):
+        super().doRollover()
+        named_threads.clear()
+
+
+def now():
+    return time.perf_counter_ns() // 1000  # Trace timestamps are in microseconds
+
+
+def emit(event):
+    thread = threading.current_thread()
+    event['pid'] = os.getpid()
+    event['tid'] = thread.ident
+
+    if thread.ident not in named_threads:
+        named_threads.add(thread.ident)
+        trace_logger.info(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': event['pid'], 'tid': thread.ident,
+                                      'args': {'name': thread.name}}) + ',')
+
+    trace_logger.info(json.dumps(event, default=str) + ',')
+
+
+class Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = now()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+
+        emit({'name': self.name, 'ph': 'X', 'ts': self.start, 'dur': now() - self.start, 'args': self.args})
+
+
+# Use as 'with tracing.span(name, **args):' - does nothing unless tracing is enabled.
+def span(name, **args):
+    return Span(name, args) if enabled else null_span
+
+
+# Called when a command is queued: returns what finish_flow() needs to link the queueing thread
+# with the one that runs the command, and to time how long it waited.
+def start_flow(method):
+    if not enabled:
+        return None
+
+    flow = (next(flow_ids), now())
+    emit({'name': method, 'cat': 'command', 'ph': 's', 'id': flow[0], 'ts': flow[1]})
+
+    return flow
+
+
+# Called from inside the span of the command once it starts running. The queue wait is an async
+# event, so it gets its own track instead of overlapping whatever its thread was doing.
+def finish_flow(flow, method):
+    if flow is None:
+        return
+
+    flow_id, queued_at = flow
+    started_at = now()
+
+    emit({'name': 'queue wait', 'cat': 'queue', 'ph': 'b', 'id': flow_id, 'ts': queued_at, 'args': {'method': method}})
+    emit({'name': 'queue wait', 'cat': 'queue', 'ph': 'e', 'id': flow_id, 'ts': started_at})
+    emit({'name': method, 'cat': 'command', 'ph': 'f', 'bp': 'e', 'id': flow_id, 'ts': started_at})
+
+
+def setup():
+    if not enabled:
+        return
+
+    handler = TraceFileHandler(config['tracing']['file'], maxBytes=config.getint('tracing', 'max_bytes'),
+                               backupCount=config.getint('tracing', 'backup_count'))
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+
+
+setup()
@@ -1,33 +1,92 @@
 # Handles the authentication and communication with the Spotify Web API.
+import ast
 import logging
 import os
 import shelve
-import sys
+import threading
 import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
 
+import configparser
 import requests
 import time
-import webbrowser
 import json
 
+import deadlines
+from auth import get_auth_backend
+import tracing
+from deadlines import EndpointLatencies
+from exceptions import DeadlineExceededError, RequestNotSentError
+from models import decode
 from notif_handler import send_notif
+from resilience import RetryPolicy, get_circuit_breaker
+from response_cache import ResponseCache
+from singleflight import SingleFlight, make_key
 
-info_file = os.path.join(os.path.dirname(__file__), '.info')
+config = configparser.ConfigParser()
+config.read(os.path.join(os.path.dirname(__file__), 'config.ini'))
+
+info_dir = os.path.dirname(__file__)
+
+# Shared by every account, as they all talk to the same servers.
+endpoint_latencies = EndpointLatencies(factor=config.getfloat('deadlines', 'timeout_factor'),
+                                       min_timeout=config.getfloat('deadlines', 'min_timeout'),
+                                       max_timeout=config.getfloat('deadlines', 'max_timeout'),
+                                       min_samples=config.getint('deadlines', 'min_samples'))
+
+
+shelf_locks = defaultdict(threading.RLock)
+
+
+# Shelves are used from several threads (commands, prefetching), which dbm doesn't allow at once.
+@contextmanager
+def open_shelf(file):
+    with shelf_locks[file], shelve.open(file) as shelf:
+        yield shelf
+
+
+# Every account keeps its tokens (and other saved info) in its own shelf; the default
+# account uses the original '.info' one. Cached responses are kept apart, in '.responses'.
+def get_info_file(account=None, name='.info'):
+    return os.path.join(info_dir, name if account is None else '{}-{}'.format(name, account))
 
 
 class WebApi:
 
-    # This follows the 'Authorization Code Flow' path set out by
-    # https://developer.spotify.com/documentation/general/guides/authorization-guide/#authorization-code-flow.
-    def __init__(self, scope_list, client_id, redirect_uri):
+    # Logging in follows either the 'Authorization Code Flow' through our relay, or the
+    # 'Authorization Code with PKCE Flow' directly with Spotify, as set out by
+    # https://developer.spotify.com/documentation/general/guides/authorization-guide/ (see auth.py).
+    def __init__(self, scope_list, client_id, account=None):
         self.api_url = 'https://api.spotify.com/v1/'
         self.authorize_access_url = 'https://accounts.spotify.com/authorize/'
+        self.token_url = 'https://accounts.spotify.com/api/token'
         self.register_user_url = 'https://platelminto.eu.pythonanywhere.com/users/complete'
         self.refresh_token_url = 'https://platelminto.eu.pythonanywhere.com/users/refresh'
 
         self.scope_list = scope_list
         self.client_id = client_id
-        self.redirect_uri = redirect_uri
+        self.auth = get_auth_backend(self, config)
+
+        self.account = account
+        self.info_file = get_info_file(account)
+
+        # Each account has its own connection pool, and refreshes its tokens on its own, so a
+        # slow refresh only holds up commands for that account.
+        self.session = requests.Session()
+        self.refresh_lock = threading.Lock()
+        self.in_flight_gets = SingleFlight()
+
+        self.response_cache = None
+        if config.getboolean('response_cache', 'enabled'):
+            self.response_cache = ResponseCache(get_info_file(account, '.responses'),
+                                                ast.literal_eval(config['response_cache']['ttls']),
+                                                config.getint('response_cache', 'max_bytes'))
+
+        self.retry_policy = RetryPolicy(attempts=config.getint('web_api', 'retry_attempts'),
+                                        base_delay=config.getfloat('web_api', 'retry_base_delay'),
+                                        max_delay=config.getfloat('web_api', 'retry_max_delay'))
 
         # Load authentication tokens, and if they do checks
         # whether they need to be refreshed.
@@ -37,15 +96,14 @@ class WebApi:
     # Called when registering as a new user
     def get_auth_info(self):
         # If we are new, re-do entire auth process.
-        with shelve.open(info_file) as shelf:
+        with open_shelf(self.info_file) as shelf:
             shelf.clear()
             new_uuid = uuid.uuid4()
             shelf['uuid'] = new_uuid
             self.uuid = shelf['uuid']
 
         current_time = time.time()
-        self.generate_auth_code()
-        info = self.get_access_info()
+        info = self.auth.authorize()
 
         self.save_auth_values(info.get('access_token'), info.get('refresh_token'),
                               current_time + info.get('expires_in'))
@@ -53,48 +111,19 @@ class WebApi:
     # The authorization keys need to be refreshed every once in a while
     def check_for_refresh_token(self, expiry_time):
         if time.time() > expiry_time:
-            self.refresh_tokens()
-
-    # This is how the user can authenticate themselves and must follow the instructions
-    # in the README.
-    def generate_auth_code(self):
-        params = {'client_id': self.client_id, 'response_type': 'code', 'state': self.uuid,
-                  'redirect_uri': self.redirect_uri,
-                  'scope': ' '.join(self.scope_list)}
-
-        r = requests.get(self.authorize_access_url, params=params)
-        webbrowser.open_new(r.url)
-
-    def get_access_info(self):
-        timeout = time.time()
-
-        while time.time() < timeout + 120:  # We spend 2 minutes waiting for auth confirmation
-            response = requests.post(self.register_user_url,
-                                     json={'uuid': str(self.uuid)})
-            if response.status_code == 200:
-                logging.info('initial authentication done.')
-                send_notif('Success', 'You are now authenticated.')
-                return response.json()
-
-            time.sleep(3)
-
-        send_notif('Could not authenticate', 'Spotify Helper closed.')
-        sys.exit('Could not authenticate')
+            with self.refresh_lock:
+                # Another thread using this account may have refreshed while we were waiting.
+                if time.time() > self.expiry_time:
+                    self.refresh_tokens()
 
     # Gets the new tokens after previous ones expire, following the format described by
     # the Spotify authorization guide.
     def refresh_tokens(self):
-        payload = {'grant_type': 'refresh_token', 'refresh_token': self.refresh_token,
-                   'uuid': str(self.uuid)}
         obtained_time = time.time()
 
-        try:
-            r = requests.post(self.refresh_token_url, json=payload, timeout=4)
-
-        except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
-            raise ConnectionError
+        r = self.auth.refresh(self.refresh_token)
 
-        # 403 indicates the user UUID is not registered on the server,
+        # 403 indicates the user UUID is not registered on the relay,
         if r.status_code == 403:
             send_notif('Authentication error', 'Please re-authenticate, or try restarting the app.')
             self.get_auth_info()
@@ -106,11 +135,11 @@ class WebApi:
         # 400-499 means there is a general user error, so we start anew with
         # the authentication process.
         if (400 <= r.status_code < 500) or \
-                (not set(r.json().get('scope').split(' ')).issuperset(set(self.scope_list))):
+                (not set(decode(r).get('scope').split(' ')).issuperset(set(self.scope_list))):
             self.get_auth_info()
             return
 
-        info = r.json()
+        info = decode(r)  # Already decoded above, so this is free
 
         if 'refresh_token' in info:
             self.refresh_token = info.get('refresh_token')
@@ -120,86 +149,127 @@ class WebApi:
         self.load_auth_values()
 
     def save_auth_values(self, access_token, refresh_token, expiry_time):
-        with shelve.open(info_file) as shelf:
+        with open_shelf(self.info_file) as shelf:
             shelf['access_token'] = access_token
             shelf['refresh_token'] = refresh_token
             shelf['expiry_time'] = expiry_time
+            shelf['auth_backend'] = self.auth.name
 
         self.load_auth_values()
 
     def load_auth_values(self):
         try:
-            with shelve.open(info_file) as shelf:
+            with open_shelf(self.info_file) as shelf:
                 self.uuid = shelf['uuid']
                 self.access_token = shelf['access_token']
                 self.refresh_token = shelf['refresh_token']
                 self.expiry_time = shelf['expiry_time']
+
+                # Tokens from one backend can't be refreshed with the other.
+                is_other_backend = shelf.get('auth_backend', 'relay') != self.auth.name
         except KeyError:
             self.get_auth_info()
+            return
+
+        if is_other_backend:
+            self.get_auth_info()
 
     # The authorization values need to be in a specified header.
     def get_access_header(self):
-        self.check_for_refresh_token(self.expiry_time)
+        with tracing.span('token check'):
+            self.check_for_refresh_token(self.expiry_time)
 
         return {'Authorization': 'Bearer ' + self.access_token}
 
-    # The following functions are wrappers around requests' basic rest functions.
-
-    def get(self, endpoint, params=None, timeout=4, retry=1):
-        try:
-            return requests.get(self.api_url + endpoint,
-                                params=params, headers=self.get_access_header(),
-                                timeout=timeout)
+    # Sends a request through this account's session, retrying it according to the retry policy
+    # and failing fast while the host's circuit breaker is open. Raises ConnectionError if no
+    # response could be obtained, or RequestNotSentError if the request can't have reached the host.
+    #
+    # timeout is only used until the endpoint's usual latency is known, and each attempt is
+    # also limited to what's left of the current command's deadline.
+    def send(self, rest_function_name, url, idempotent, timeout=4, **kwargs):
+        breaker = get_circuit_breaker(url, failure_threshold=config.getint('web_api', 'breaker_failure_threshold'),
+                                      probe_interval=config.getfloat('web_api', 'breaker_probe_interval'))
+        delays = self.retry_policy.delays()
+        latency_key = EndpointLatencies.get_key(rest_function_name, urlsplit(url).path)
+
+        while True:
+            breaker.check()
+            endpoint_timeout = endpoint_latencies.get_timeout(latency_key, timeout)
+            attempt_timeout = deadlines.get_timeout(endpoint_timeout)
+            sent_at = time.monotonic()
+
+            try:
+                with tracing.span('http', rest_function_name=rest_function_name, url=url, timeout=attempt_timeout):
+                    response = getattr(self.session, rest_function_name)(url, timeout=attempt_timeout, **kwargs)
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Running out of what was left of the command's deadline says nothing about the
+                # host, nor how long the endpoint takes.
+                if not isinstance(e, requests.exceptions.Timeout) or attempt_timeout >= endpoint_timeout:
+                    breaker.record_failure()
+
+                    # A timeout still tells us the endpoint takes at least this long.
+                    if isinstance(e, requests.exceptions.Timeout):
+                        endpoint_latencies.observe(latency_key, attempt_timeout)
+
+                delay = next(delays, None) if RetryPolicy.can_retry_exception(e, idempotent) else None
+
+                if delay is None and RetryPolicy.was_not_sent(e):
+                    raise RequestNotSentError from e
+                elif delay is None:
+                    raise ConnectionError from e
+                elif not deadlines.has_time_for(delay):
+                    raise DeadlineExceededError from e
+            else:
+                endpoint_latencies.observe(latency_key, time.monotonic() - sent_at)
+
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+                delay = self.retry_policy.get_retry_delay(response, idempotent, delays)
+
+                if delay is None or not deadlines.has_time_for(delay):
+                    return response
+
+            logging.info('Retrying {} {} in {:.2f}s'.format(rest_function_name.upper(), url, delay))
+            time.sleep(delay)
 
-        except requests.exceptions.ConnectionError:
-            if retry != 0:
-                return self.get(endpoint, params, timeout, retry - 1)
-        except requests.exceptions.ReadTimeout:
-            pass
+    # The following functions are wrappers around requests' basic rest functions.
 
-        raise ConnectionError
+    # Identical GETs made at the same time share one request (and the same response, whose body
+    # models.decode() then only decodes once).
+    def get(self, endpoint, params=None, timeout=4):
+        return self.in_flight_gets.do(make_key(endpoint, params=params),
+                                      lambda: self.get_through_cache(endpoint, params, timeout))
 
-    def post(self, endpoint, params=None, payload=None, timeout=4, retry=1):
-        try:
-            return requests.post(self.api_url + endpoint,
-                                 data=json.dumps(payload), params=params,
-                                 headers=self.get_access_header(),
-                                 timeout=timeout)
+    def get_through_cache(self, endpoint, params, timeout):
+        def send(headers):
+            return self.send('get', self.api_url + endpoint, True, params=params,
+                             headers={**self.get_access_header(), **headers}, timeout=timeout)
 
-        except requests.exceptions.ConnectionError:
-            if retry != 0:
-                return self.post(endpoint, params, payload, timeout, retry - 1)
-        except requests.exceptions.ReadTimeout:
-            pass
+        if self.response_cache is None:
+            return send({})
 
-        raise ConnectionError
+        return self.response_cache.get(endpoint, params, send)
 
-    def put(self, endpoint, params=None, payload=None, timeout=4, retry=1):
-        try:
-            return requests.put(self.api_url + endpoint,
-                                data=json.dumps(payload), params=params,
-                                headers=self.get_access_header(),
-                                timeout=timeout)
+    def post(self, endpoint, params=None, payload=None, timeout=4):
+        return self.send_change('post', endpoint, False, params, payload, timeout)
 
-        except requests.exceptions.ConnectionError:
-            if retry != 0:
-                return self.put(endpoint, params, payload, timeout, retry - 1)
-        except requests.exceptions.ReadTimeout:
-            pass
+    def put(self, endpoint, params=None, payload=None, timeout=4):
+        return self.send_change('put', endpoint, True, params, payload, timeout)
 
-        raise ConnectionError
+    def delete(self, endpoint, params=None, payload=None, timeout=4):
+        return self.send_change('delete', endpoint, True, params, payload, timeout)
 
-    def delete(self, endpoint, params=None, payload=None, timeout=4, retry=1):
+    def send_change(self, rest_function_name, endpoint, idempotent, params, payload, timeout):
         try:
-            return requests.delete(self.api_url + endpoint,
-                                   data=json.dumps(payload), params=params,
-                                   headers=self.get_access_header(),
-                                   timeout=timeout)
-
-        except requests.exceptions.ConnectionError:
-            if retry != 0:
-                return self.delete(endpoint, params, payload, timeout, retry - 1)
-        except requests.exceptions.ReadTimeout:
-            pass
-
-        raise ConnectionError
+            return self.send(rest_function_name, self.api_url + endpoint, idempotent,
+                             data=json.dumps(payload), params=params, headers=self.get_access_header(),
+                             timeout=timeout)
+        finally:
+            # Even a failed request may have changed something.
+            if self.response_cache is not None:
+                self.response_cache.invalidate(endpoint)
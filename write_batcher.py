@@ -0,0 +1,83 @@
+# Optionally holds library and monthly playlist changes back for a few seconds, so saving tracks
+# while skipping through them sends one request per 50 (library) or 100 (playlist) tracks, rather
+# than one per track. Changing a track back before its change is sent (e.g. saving and then
+# unsaving it) cancels both. Commands notify straight away, as if their change had been made, so
+# a notification is also sent if changes fail to go through.
+import logging
+import threading
+from collections import OrderedDict
+
+import deadlines
+from notif_handler import send_notif
+
+
+class WriteBatcher:
+
+    # send(collection, song_ids, added) makes the changes, e.g. adding song_ids to the library,
+    # and has up to budget seconds to do so. Changes are sent window seconds after the first.
+    def __init__(self, send, window=2, budget=10):
+        self.send = send
+        self.window = window
+        self.budget = budget
+
+        self.pending = OrderedDict()  # (collection, song id) -> whether it is being added
+        self.sending = {}  # The same, for changes being sent right now
+        self.timer = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # Keeps flushes in order
+
+    def add(self, collection, song_id, added):
+        key = (collection, song_id)
+
+        with self.lock:
+            if self.pending.get(key) == (not added):
+                del self.pending[key]
+            else:
+                self.pending[key] = added
+
+            if self.timer is None and self.pending:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.name = 'write-batcher'
+                self.timer.daemon = True
+                self.timer.start()
+
+    # Whether song_id is going to be added to (True) or removed from (False) collection, or None
+    # if it isn't changing, so commands see changes that haven't been sent yet.
+    def get_pending(self, collection, song_id):
+        key = (collection, song_id)
+
+        with self.lock:
+            added = self.pending.get(key)
+
+            return self.sending.get(key) if added is None else added
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+                self.sending, self.pending = self.pending, OrderedDict()
+
+            # One send per collection and kind of change, in the order they were first made.
+            changes = OrderedDict()
+            for (collection, song_id), added in self.sending.items():
+                changes.setdefault((collection, added), []).append(song_id)
+
+            failed = 0
+            for (collection, added), song_ids in changes.items():
+                try:
+                    with deadlines.Deadline(self.budget):
+                        self.send(collection, song_ids, added)
+                except Exception as e:
+                    logging.warning('Could not {} {} tracks {} {}: {}'.format(
+                        'add' if added else 'remove', len(song_ids), 'to' if added else 'from', collection, repr(e)))
+                    failed += len(song_ids)
+
+            with self.lock:
+                self.sending = {}
+
+        if failed:
+            send_notif('Changes not saved', '{} library or playlist changes could not be made, try again.'
+                       .format(failed))